@@ -0,0 +1,45 @@
+"""add users updated_at and lower email index
+
+Revision ID: 16375137165e
+Revises: 439ee63de306
+Create Date: 2026-10-18 05:03:39.034525
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '16375137165e'
+down_revision = '439ee63de306'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nullable without a default: adding it does not rewrite the table
+    op.add_column(
+        'users', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=True)
+    )
+    # lookups by lower(email), and the email filter sync of renamed users
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_users_email_lower', 'users', [sa.text('lower(email)')],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_users_updated_at', 'users', ['updated_at'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_updated_at', table_name='users',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_users_email_lower', table_name='users',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,33 @@
+"""create revoked tokens table
+
+Revision ID: 3b569f79bef9
+Revises: 8252fc0bcf43
+Create Date: 2026-10-18 04:37:33.439129
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+# revision identifiers, used by Alembic.
+revision = '3b569f79bef9'
+down_revision = '8252fc0bcf43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('jti', sa.String(), primary_key=True, nullable=False),
+        sa.Column('user_id', UUID(as_uuid=True), nullable=True),
+        sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('revoked_at', sa.TIMESTAMP(timezone=True),
+                  server_default=sa.text('now()'), nullable=False),
+    )
+    op.create_index('ix_revoked_tokens_revoked_at', 'revoked_tokens', ['revoked_at'])
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+
+
+def downgrade():
+    op.drop_table('revoked_tokens')
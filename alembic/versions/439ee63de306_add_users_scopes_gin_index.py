@@ -0,0 +1,32 @@
+"""add users scopes gin index
+
+Revision ID: 439ee63de306
+Revises: 7b5addfe4343
+Create Date: 2026-10-18 04:52:59.882282
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '439ee63de306'
+down_revision = '7b5addfe4343'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # serves `scopes && ARRAY[...]` lookups of who holds a permission
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_users_scopes', 'users', ['scopes'],
+            postgresql_using='gin', postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_scopes', table_name='users',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,31 @@
+"""create login attempts table
+
+Revision ID: 7b5addfe4343
+Revises: 3b569f79bef9
+Create Date: 2026-10-18 04:39:42.555463
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7b5addfe4343'
+down_revision = '3b569f79bef9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # throttling counters are disposable, so skip the WAL
+    op.create_table(
+        'login_attempts',
+        sa.Column('key', sa.String(), primary_key=True, nullable=False),
+        sa.Column('window_start', sa.BigInteger(), nullable=False),
+        sa.Column('current', sa.Integer(), nullable=False),
+        sa.Column('previous', sa.Integer(), nullable=False),
+        prefixes=['UNLOGGED'],
+    )
+
+
+def downgrade():
+    op.drop_table('login_attempts')
@@ -0,0 +1,42 @@
+"""create refresh tokens table
+
+Revision ID: 8252fc0bcf43
+Revises: c16ec7da6a7c
+Create Date: 2026-10-18 04:35:44.830649
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql.expression import text
+
+# revision identifiers, used by Alembic.
+revision = '8252fc0bcf43'
+down_revision = 'c16ec7da6a7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'refresh_tokens',
+        sa.Column('id', UUID(as_uuid=True), primary_key=True, nullable=False,
+                  server_default=text("gen_random_uuid()")),
+        sa.Column('token_hash', sa.String(), nullable=False),
+        sa.Column('user_id', UUID(as_uuid=True),
+                  sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('family_id', UUID(as_uuid=True), nullable=False),
+        sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('used_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('revoked_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True),
+                  server_default=sa.text('now()'), nullable=False),
+    )
+    op.create_index('ix_refresh_tokens_token_hash', 'refresh_tokens',
+                    ['token_hash'], unique=True)
+    op.create_index('ix_refresh_tokens_family_id', 'refresh_tokens', ['family_id'])
+    op.create_index('ix_refresh_tokens_user_id', 'refresh_tokens', ['user_id'])
+
+
+def downgrade():
+    op.drop_table('refresh_tokens')
@@ -0,0 +1,32 @@
+"""add refresh tokens expires_at index
+
+Revision ID: a4c2e9d51f07
+Revises: d79437a700ad
+Create Date: 2026-10-18 06:20:11.418532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a4c2e9d51f07'
+down_revision = 'd79437a700ad'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # expired tokens are purged in small batches found through this index
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_refresh_tokens_expires_at', table_name='refresh_tokens',
+            postgresql_concurrently=True,
+        )
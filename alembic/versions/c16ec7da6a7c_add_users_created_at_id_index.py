@@ -0,0 +1,32 @@
+"""add users created_at id index
+
+Revision ID: c16ec7da6a7c
+Revises: 5ba864f5193c
+Create Date: 2026-10-18 04:34:43.079760
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c16ec7da6a7c'
+down_revision = '5ba864f5193c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # build without locking out writes on a large users table
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_users_created_at_id', 'users', ['created_at', 'id'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_created_at_id', table_name='users',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,61 @@
+"""make lower email unique
+
+Emails are stored lowercased and unique in any case. Users whose emails
+differ only in case are not merged here: the upgrade stops and lists them,
+to be merged by hand before it is run again.
+
+Revision ID: d79437a700ad
+Revises: e37ff3cfc3c0
+Create Date: 2026-10-18 05:54:23.296149
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd79437a700ad'
+down_revision = 'e37ff3cfc3c0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT lower(email), array_agg(id::text ORDER BY created_at, id) '
+        'FROM users GROUP BY lower(email) HAVING count(*) > 1 '
+        'ORDER BY lower(email)'
+    )).all()
+    if duplicates:
+        listed = '\n'.join(
+            f'  {email}: {", ".join(ids)}' for email, ids in duplicates
+        )
+        raise RuntimeError(
+            'Some emails belong to several users when case is ignored. '
+            f'Merge these users (ids oldest first) and upgrade again:\n{listed}'
+        )
+    op.execute(
+        'UPDATE users SET email = lower(email), updated_at = now() '
+        'WHERE email <> lower(email)'
+    )
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_email_lower', table_name='users',
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_users_email_lower', 'users', [sa.text('lower(email)')],
+            unique=True, postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    # emails stay lowercased
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_email_lower', table_name='users',
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_users_email_lower', 'users', [sa.text('lower(email)')],
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,40 @@
+"""create audit events table
+
+Revision ID: e37ff3cfc3c0
+Revises: 16375137165e
+Create Date: 2026-10-18 05:12:19.277102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e37ff3cfc3c0'
+down_revision = '16375137165e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # no foreign keys: the trail outlives the users it mentions
+    op.create_table(
+        'audit_events',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('event', sa.String(), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('actor_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('ip', sa.String(), nullable=True),
+        sa.Column('detail', postgresql.JSONB(), nullable=True),
+    )
+    op.create_index(
+        'ix_audit_events_created_at', 'audit_events', ['created_at']
+    )
+    op.create_index(
+        'ix_audit_events_user_id_id', 'audit_events', ['user_id', 'id']
+    )
+
+
+def downgrade():
+    op.drop_table('audit_events')
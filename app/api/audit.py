@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from fastapi import Depends, Query, Security
+from pydantic import UUID4
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config, database, models, oauth2, schemas
+
+
+async def events(
+    user_id: Optional[UUID4] = Query(None),
+    event: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    before: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1),
+    db: AsyncSession = Depends(database.get_read_session),
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"]),
+) -> Dict:
+    """
+    Audit events, newest first. Events are written in batches, so the last
+    `AUDIT_FLUSH_SECONDS` may not be listed yet
+    :param user_id: only events about this user
+    :param event: only events of this kind, e.g. `login_failed`
+    :param since: only events at or after this time
+    :param until: only events before this time
+    :param before: `next_before` of the previous page
+    :param limit: page size, at most `AUDIT_QUERY_MAX_LIMIT`
+    :param db: database session
+    :param current_user: check current user permissions, should have `admin` scopes
+    :return dict `items`: events, `next_before`: cursor of the next page or None
+    """
+    table = models.AuditEvent
+    query = select(table).order_by(table.id.desc())
+    if user_id is not None:
+        query = query.where(table.user_id == user_id)
+    if event is not None:
+        query = query.where(table.event == event)
+    if since is not None:
+        query = query.where(table.created_at >= since)
+    if until is not None:
+        query = query.where(table.created_at < until)
+    if before is not None:
+        query = query.where(table.id < before)
+
+    limit = min(limit, config.settings.audit_query_max_limit)
+    result = await db.execute(query.limit(limit + 1))
+    items = result.scalars().all()
+    next_before = items[limit - 1].id if len(items) > limit else None
+    return {"items": items[:limit], "next_before": next_before}
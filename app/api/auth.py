@@ -1,37 +1,291 @@
-from typing import Dict
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, Security, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import database, models, oauth2, utils
+from app import (audit, config, database, emails, models, oauth2, permissions,
+                 schemas, throttle, utils)
 
+# expired refresh tokens deleted with each one issued; more than one, so
+# the backlog of a purge-free past shrinks
+REFRESH_TOKEN_PURGE_BATCH = 100
 
-def login(
+
+@lru_cache()
+def get_login_throttle() -> throttle.LoginThrottle:
+    settings = config.get_settings()
+    return throttle.LoginThrottle(
+        throttle.load_backend(
+            settings.login_throttle_backend,
+            max_keys=settings.login_throttle_max_keys,
+        ),
+        per_email=settings.login_rate_per_email,
+        per_ip=settings.login_rate_per_ip,
+        window=settings.login_rate_window,
+    )
+
+
+__getattr__ = config.lazy_attributes(__name__, {"login_throttle": get_login_throttle})
+
+
+async def login(
+    request: Request,
     user_credentials: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(database.get_session),
+    db: AsyncSession = Depends(database.get_session),
 ) -> Dict:
     if user_credentials.username is None:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Invalid credentials",
         )
-    user = (
-        db.query(models.User)
-        .filter(models.User.email == user_credentials.username)
-        .first()
-    )
+    ip = request.client.host if request.client else None
+    retry_after = await get_login_throttle().check(user_credentials.username, ip)
+    if retry_after:
+        audit.record("login_throttled", ip=ip, email=user_credentials.username)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": throttle.retry_after_header(retry_after)},
+        )
+    user = await _find_user(db, user_credentials.username)
     if not user:
+        await utils.verify_dummy(user_credentials.password)
+        audit.record(
+            "login_failed",
+            ip=ip,
+            email=user_credentials.username,
+            reason="unknown_email",
+        )
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Invalid credentials"
         )
 
-    if not utils.verify(user_credentials.password, user.password):
+    verified, new_hash = await utils.verify_and_update(
+        user_credentials.password, user.password
+    )
+    if not verified:
+        audit.record(
+            "login_failed",
+            user_id=user.id,
+            ip=ip,
+            email=user_credentials.username,
+            reason="wrong_password",
+        )
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Invalid credentials"
         )
+    if new_hash:
+        # skipped if the password was changed since it was read
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == user.id, models.User.password == user.password)
+            .values(password=new_hash, updated_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+
+    access_token = oauth2.create_access_token(
+        data={"user_id": str(user.id), "perms": permissions.mask(user.scopes)}
+    )
+    refresh_token = await _issue_refresh_token(db, user.id, family_id=uuid.uuid4())
+    await db.commit()
+    audit.record("login", user_id=user.id, ip=ip)
+    tokens = {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+    if config.settings.fast_responses:
+        return ORJSONResponse(tokens)
+    return tokens
+
+
+async def _find_user(db: AsyncSession, email: str):
+    """
+    User logging in as `email`, any case. A definite miss of the email
+    filter answers None without a query
+    """
+    email_filter = await emails.synced_filter(db)
+    if email_filter is not None and not email_filter.might_exist(email):
+        return None
+    result = await db.execute(
+        select(models.User).where(
+            func.lower(models.User.email) == emails.normalize(email)
+        )
+    )
+    return result.scalars().first()
+
+
+async def refresh(
+    token: schemas.TokenRefresh,
+    db: AsyncSession = Depends(database.get_session),
+) -> Dict:
+    """
+    Exchange a refresh token for a new access and refresh token pair.
+    Each refresh token is single use; presenting one that was already used
+    revokes every token descended from the same login
+    :param token: refresh token issued by `/login` or a previous refresh
+    :param db: database session
+    :return dict `access_token`, `token_type`, `refresh_token`
+    """
+    token_hash = oauth2.hash_refresh_token(token.refresh_token)
+    tokens = models.RefreshToken.__table__
+    result = await db.execute(
+        update(tokens)
+        .where(
+            tokens.c.token_hash == token_hash,
+            tokens.c.used_at.is_(None),
+            tokens.c.revoked_at.is_(None),
+            tokens.c.expires_at > func.now(),
+            models.User.id == tokens.c.user_id,
+        )
+        .values(used_at=func.now())
+        .returning(tokens.c.user_id, tokens.c.family_id, models.User.scopes)
+    )
+    used = result.first()
+    if used is None:
+        await _revoke_reused_family(db, token_hash)
+        await db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid refresh token"
+        )
 
     access_token = oauth2.create_access_token(
-        data={"user_id": str(user.id), "scopes": user.scopes}
+        data={"user_id": str(used.user_id), "perms": permissions.mask(used.scopes)}
+    )
+    refresh_token = await _issue_refresh_token(db, used.user_id, used.family_id)
+    await db.commit()
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+async def logout(
+    body: Optional[schemas.Logout] = None,
+    token: str = Depends(oauth2.oauth2_scheme),
+    db: AsyncSession = Depends(database.get_session),
+    current_user: schemas.UserOut = Depends(oauth2.get_current_user),
+):
+    """
+    Revoke the presented access token before it expires, and the refresh
+    token family of `refresh_token` when one is given
+    :param body: optional refresh token to revoke along with the access token
+    :param token: access token being revoked
+    :param db: database session
+    :param current_user: owner of the token
+    :return: 204 No Content
+    """
+    token_data = oauth2.decode_token_data(token)
+    revoked = models.RevokedToken.__table__
+    if token_data.jti:
+        expires_at = datetime.fromtimestamp(token_data.exp, timezone.utc)
+        await db.execute(
+            postgresql.insert(revoked)
+            .values(jti=token_data.jti, user_id=current_user.id, expires_at=expires_at)
+            .on_conflict_do_nothing()
+        )
+        oauth2.denylist.add(token_data.jti, expires_at)
+    if body and body.refresh_token:
+        tokens = models.RefreshToken.__table__
+        family = (
+            select(tokens.c.family_id)
+            .where(
+                tokens.c.token_hash == oauth2.hash_refresh_token(body.refresh_token),
+                tokens.c.user_id == current_user.id,
+            )
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(tokens)
+            .where(tokens.c.family_id == family, tokens.c.revoked_at.is_(None))
+            .values(revoked_at=func.now())
+        )
+    await db.execute(delete(revoked).where(revoked.c.expires_at < func.now()))
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def _issue_refresh_token(db: AsyncSession, user_id, family_id) -> str:
+    refresh_token, token_hash = oauth2.create_refresh_token()
+    expires_at = datetime.utcnow() + timedelta(
+        days=config.settings.refresh_token_expire_days
+    )
+    await db.execute(
+        insert(models.RefreshToken).values(
+            token_hash=token_hash,
+            user_id=user_id,
+            family_id=family_id,
+            expires_at=expires_at,
+        )
+    )
+    await _purge_expired_refresh_tokens(db)
+    return refresh_token
+
+
+async def _purge_expired_refresh_tokens(db: AsyncSession):
+    """
+    Delete a few expired refresh tokens with each one issued, so the table
+    holds about the tokens of one lifetime. Rows another request is purging
+    are skipped rather than waited for
+    """
+    tokens = models.RefreshToken.__table__
+    expired = (
+        select(tokens.c.id)
+        .where(tokens.c.expires_at < func.now())
+        .limit(REFRESH_TOKEN_PURGE_BATCH)
+        .with_for_update(skip_locked=True)
+    )
+    await db.execute(delete(tokens).where(tokens.c.id.in_(expired)))
+
+
+async def _revoke_reused_family(db: AsyncSession, token_hash: str):
+    """A used token coming back means it leaked: revoke its whole family."""
+    tokens = models.RefreshToken.__table__
+    reused_family = (
+        select(tokens.c.family_id)
+        .where(tokens.c.token_hash == token_hash, tokens.c.used_at.isnot(None))
+        .scalar_subquery()
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    await db.execute(
+        update(tokens)
+        .where(tokens.c.family_id == reused_family, tokens.c.revoked_at.is_(None))
+        .values(revoked_at=func.now())
+    )
+
+
+async def introspect(
+    body: schemas.Introspect,
+    db: AsyncSession = Depends(database.get_read_session),
+    caller: schemas.UserOut = Security(
+        oauth2.get_current_user, scopes=["tokens:introspect"]
+    ),
+) -> Dict:
+    """
+    Check access tokens on behalf of services that cannot verify them
+    :param body: tokens to check, at most `INTROSPECT_MAX_TOKENS`
+    :param db: database session
+    :param caller: needs the `tokens:introspect` permission
+    :return dict `results`: one per token, in order, `active` plus `sub`,
+        `scope` and `exp` for active tokens
+    """
+    if len(body.tokens) > config.settings.introspect_max_tokens:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {config.settings.introspect_max_tokens} tokens per request",
+        )
+    return {"results": await oauth2.introspect(db, body.tokens)}
+
+
+async def jwks(response: Response) -> Dict:
+    response.headers[
+        "Cache-Control"
+    ] = f"public, max-age={config.settings.jwt_keys_reload_seconds}"
+    return oauth2.keyring.jwks()
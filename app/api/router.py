@@ -2,7 +2,7 @@ from fastapi import APIRouter
 from starlette import status
 
 from app import schemas
-from app.api import auth, user
+from app.api import audit, auth, stats, user
 
 router = APIRouter()
 
@@ -17,6 +17,43 @@ router.add_api_route(
         200: {"detail": "Successfully logged in"},
         403: {"detail": "Invalid credentials"},
         422: {"detail": "Required field missing"},
+        429: {"detail": "Too many login attempts"},
+    },
+)
+
+router.add_api_route(
+    "/token/refresh",
+    methods=["POST"],
+    endpoint=auth.refresh,
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.Token,
+    tags=["Authentication"],
+    responses={
+        200: {"detail": "Tokens refreshed"},
+        403: {"detail": "Invalid refresh token"},
+    },
+)
+
+router.add_api_route(
+    "/logout",
+    methods=["POST"],
+    endpoint=auth.logout,
+    status_code=status.HTTP_204_NO_CONTENT,
+    tags=["Authentication"],
+    responses={
+        204: {"detail": "Token revoked"},
+        401: {"detail": "Could not validate credentials"},
+    },
+)
+
+router.add_api_route(
+    "/.well-known/jwks.json",
+    methods=["GET"],
+    endpoint=auth.jwks,
+    status_code=status.HTTP_200_OK,
+    tags=["Authentication"],
+    responses={
+        200: {"detail": "Public keys for verifying access tokens"},
     },
 )
 
@@ -33,6 +70,60 @@ router.add_api_route(
     },
 )
 
+router.add_api_route(
+    "/users",
+    methods=["GET"],
+    endpoint=user.list_users,
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.UserPage,
+    tags=["CRUD Users"],
+    responses={
+        200: {"detail": "Page of users, or an NDJSON export with stream=true"},
+        403: {"detail": "Not authorized to perform requested action"},
+        422: {"detail": "Invalid cursor"},
+    },
+)
+
+router.add_api_route(
+    "/users/batch-get",
+    methods=["POST"],
+    endpoint=user.batch_get_users,
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.UserBatchOut,
+    tags=["CRUD Users"],
+    responses={
+        200: {"detail": "Found users keyed by id and the ids that do not exist"},
+        422: {"detail": "Too many ids requested"},
+    },
+)
+
+router.add_api_route(
+    "/introspect",
+    methods=["POST"],
+    endpoint=auth.introspect,
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.IntrospectOut,
+    response_model_exclude_none=True,
+    tags=["Authentication"],
+    responses={
+        200: {"detail": "Introspection result per token"},
+        401: {"detail": "Not enough permissions"},
+        422: {"detail": "Too many tokens requested"},
+    },
+)
+
+router.add_api_route(
+    "/users/import",
+    methods=["POST"],
+    endpoint=user.import_users,
+    status_code=status.HTTP_200_OK,
+    tags=["CRUD Users"],
+    responses={
+        200: {"detail": "NDJSON report of rejected rows and a summary"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
 router.add_api_route(
     "/users/{idx}",
     methods=["GET"],
@@ -98,3 +189,137 @@ router.add_api_route(
         403: {"detail": "Not authorized to perform requested action"},
     },
 )
+
+router.add_api_route(
+    "/audit",
+    methods=["GET"],
+    endpoint=audit.events,
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.AuditPage,
+    tags=["Audit"],
+    responses={
+        200: {"detail": "Audit events, newest first"},
+        401: {"detail": "Not enough permissions"},
+        422: {"detail": "Invalid filter"},
+    },
+)
+
+router.add_api_route(
+    "/stats/hashing",
+    methods=["GET"],
+    endpoint=stats.hashing,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Password hashing pool statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/user-cache",
+    methods=["GET"],
+    endpoint=stats.user_cache,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Authenticated user cache statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/token-cache",
+    methods=["GET"],
+    endpoint=stats.token_cache,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Verified token cache statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/revocation",
+    methods=["GET"],
+    endpoint=stats.revocation,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Revoked token denylist statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/login-throttle",
+    methods=["GET"],
+    endpoint=stats.login_throttle,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Login throttling statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/email-filter",
+    methods=["GET"],
+    endpoint=stats.email_filter,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Registered email filter statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/audit",
+    methods=["GET"],
+    endpoint=stats.audit_log,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Audit log queue statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/profiling",
+    methods=["GET"],
+    endpoint=stats.profiles,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Request profiling statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/slow-queries",
+    methods=["GET"],
+    endpoint=stats.slow_queries,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Latest slow SQL statements"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
+
+router.add_api_route(
+    "/stats/db-pool",
+    methods=["GET"],
+    endpoint=stats.db_pool,
+    status_code=status.HTTP_200_OK,
+    tags=["Stats"],
+    responses={
+        200: {"detail": "Database connection pool statistics"},
+        403: {"detail": "Not authorized to perform requested action"},
+    },
+)
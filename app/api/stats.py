@@ -0,0 +1,91 @@
+import os
+from typing import Dict
+
+from fastapi import Security
+
+from app import (audit, config, database, emails, metrics, oauth2, profiling,
+                 schemas, utils)
+from app.api import auth
+
+
+async def hashing(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return utils.hashing_executor.stats()
+
+
+async def user_cache(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return oauth2.user_cache.stats()
+
+
+async def token_cache(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return oauth2.token_cache_stats()
+
+
+async def revocation(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return oauth2.denylist.stats()
+
+
+async def login_throttle(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return auth.login_throttle.stats()
+
+
+async def email_filter(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return {
+        "enabled": config.settings.email_filter,
+        **emails.get_email_filter().stats(),
+    }
+
+
+async def audit_log(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return audit.get_audit_log().stats()
+
+
+async def profiles(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return {
+        "enabled": config.settings.profiling,
+        **profiling.get_profiler().stats(),
+    }
+
+
+async def slow_queries(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    return metrics.get_slow_query_log().stats()
+
+
+async def db_pool(
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
+) -> Dict:
+    """
+    Connection pools of the worker serving the request, read replicas
+    included. Each worker may open up to `pool_size + max_overflow`
+    connections per engine in use
+    """
+    replica_set = database.get_replica_set()
+    return {
+        "pid": os.getpid(),
+        "pre_ping": config.settings.db_pool_pre_ping,
+        "recycle": config.settings.db_pool_recycle,
+        "pgbouncer": config.settings.db_pgbouncer,
+        "sync": database.pool_stats(database.engine),
+        "async": database.pool_stats(database.async_engine.sync_engine),
+        "replicas": [
+            {**replica, **database.pool_stats(getattr(engine, "sync_engine", engine))}
+            for engine, replica in zip(replica_set.engines, replica_set.stats())
+        ],
+    }
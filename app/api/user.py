@@ -1,165 +1,387 @@
-from typing import Dict
+import base64
+import json
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
 
-from fastapi import (Depends, HTTPException, Path, Query, Response, Security,
-                     status)
+from fastapi import (Depends, HTTPException, Path, Query, Request, Response,
+                     Security, status)
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import UUID4
-from sqlalchemy.orm import Session
+from sqlalchemy import (String, any_, bindparam, delete, func, select, tuple_,
+                        update)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.background import BackgroundTask
 
-from app import database, models, oauth2, schemas, utils
+from app import (audit, config, database, emails, importer, models, oauth2,
+                 permissions, schemas, utils)
 
+# columns of `schemas.UserOut`, returned by every write
+USER_OUT_COLUMNS = (
+    models.User.id,
+    models.User.email,
+    models.User.scopes,
+    models.User.created_at,
+)
 
-def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_session)):
-    user_exists = db.query(models.User).filter(models.User.email == user.email).first()
-    if user_exists:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"User with email: {user.email} already exists",
-        )
-
-    hashed_password = utils.hash_pass(user.password)
-    user.password = hashed_password
 
-    new_user = models.User(**user.dict())
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+async def create_user(
+    user: schemas.UserCreate, db: AsyncSession = Depends(database.get_session)
+):
+    email_filter = await emails.synced_filter(db)
+    # with the email filter on, a taken email is refused before paying for
+    # the hash, and only emails the filter may hold cost that query
+    if email_filter is not None and email_filter.might_exist(user.email):
+        if await db.scalar(
+            select(models.User.id).where(func.lower(models.User.email) == user.email)
+        ):
+            raise _email_taken(user.email)
+    user.password = await utils.hash_pass(user.password)
+    result = await db.execute(
+        postgresql.insert(models.User)
+        .values(**user.dict())
+        .on_conflict_do_nothing(index_elements=[func.lower(models.User.email)])
+        .returning(*USER_OUT_COLUMNS)
+    )
+    new_user = result.first()
+    await db.commit()
+    if new_user is None:
+        raise _email_taken(user.email)
+    database.mark_written()
+    if email_filter is not None:
+        email_filter.add(new_user.email)
     return new_user
 
 
-def get_user(idx: UUID4, db: Session = Depends(database.get_session)):
-    user = db.query(models.User).filter(models.User.id == idx).first()
+async def get_user(idx: UUID4, db: AsyncSession = Depends(database.get_read_session)):
+    result = await db.execute(select(*USER_OUT_COLUMNS).where(models.User.id == idx))
+    user = result.first()
 
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with id: {idx} does not exist",
         )
+    if config.settings.fast_responses:
+        # the row already has the exact `UserOut` fields, skip re-validation;
+        # asyncpg returns its own UUID type, which orjson does not serialize
+        return ORJSONResponse({**user._asdict(), "id": str(user.id)})
     return user
 
 
-def delete_user(
-    idx: UUID4,
-    db: Session = Depends(database.get_session),
-    current_user: int = Depends(oauth2.get_current_user),
+async def batch_get_users(
+    batch: schemas.UserBatchGet, db: AsyncSession = Depends(database.get_read_session)
 ):
-    user = db.query(models.User).filter(models.User.id == idx).first()
-    if not user:
+    """
+    Resolve many users in one query
+    :param batch: ids to look up, at most `BATCH_GET_MAX_IDS`
+    :param db: database session
+    :return dict `users`: found users keyed by id, `missing`: ids not found
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    if len(ids) > config.settings.batch_get_max_ids:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with id: {idx} does not exist",
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {config.settings.batch_get_max_ids} ids per request",
         )
-    if user.id != current_user.id:
+    result = await db.execute(
+        select(models.User).where(
+            models.User.id
+            == any_(bindparam("ids", ids, type_=ARRAY(UUID(as_uuid=True))))
+        )
+    )
+    users = {str(user.id): user for user in result.scalars()}
+    return {"users": users, "missing": [idx for idx in ids if str(idx) not in users]}
+
+
+async def list_users(
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False),
+    permission: Optional[str] = Query(None),
+    db: AsyncSession = Depends(database.get_read_session),
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"]),
+):
+    """
+    List users ordered by creation time with keyset pagination
+    :param limit: page size, at most `LIST_USERS_MAX_LIMIT`
+    :param cursor: `next_cursor` of the previous page
+    :param stream: export every user after `cursor` as NDJSON instead of a page
+    :param permission: only users granted this permission, directly or by a role
+    :param db: database session
+    :param current_user: check current user permissions, should have `admin` scopes
+    :return dict `items`: users, `next_cursor`: cursor of the next page or None
+    """
+    query = select(models.User).order_by(models.User.created_at, models.User.id)
+    if cursor is not None:
+        query = query.where(
+            tuple_(models.User.created_at, models.User.id) > _decode_cursor(cursor)
+        )
+    if permission is not None:
+        if permission not in permissions.BITS:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Unknown permission: {permission}",
+            )
+        granting = bindparam(
+            "granting", list(permissions.granting(permission)), type_=ARRAY(String)
+        )
+        query = query.where(models.User.scopes.op("&&")(granting))
+    if stream:
+        result = await db.stream(query)
+        return StreamingResponse(
+            _user_lines(result), media_type="application/x-ndjson"
+        )
+
+    limit = min(limit, config.settings.list_users_max_limit)
+    result = await db.execute(query.limit(limit + 1))
+    users = result.scalars().all()
+    next_cursor = _encode_cursor(users[limit - 1]) if len(users) > limit else None
+    return {"items": users[:limit], "next_cursor": next_cursor}
+
+
+async def _user_lines(result):
+    async for users in result.scalars().partitions(1000):
+        yield "".join(schemas.UserOut.from_orm(user).json() + "\n" for user in users)
+
+
+def _encode_cursor(user) -> str:
+    raw = f"{user.created_at.isoformat()}|{user.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, idx = raw.split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(idx)
+    except ValueError:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to perform requested action",
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Invalid cursor",
         )
-    user.delete(synchronize_session=False)
-    db.commit()
+
+
+async def import_users(
+    request: Request,
+    conn=Depends(database.get_raw_connection),
+    current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"]),
+):
+    """
+    Bulk import users streamed as NDJSON, or CSV with `Content-Type: text/csv`.
+    Rows carry `email`, a plain `password` or a passlib `password_hash`, and
+    optional `scopes`
+    :param request: request whose body is read line by line
+    :param conn: asyncpg connection used for COPY
+    :param current_user: check current user permissions, should have `admin` scopes
+    :return NDJSON stream: one line per rejected row, then a summary line
+    """
+    content_type = request.headers.get("content-type", "")
+    fmt = "csv" if content_type.startswith("text/csv") else "ndjson"
+    # the body has to be consumed before a streaming response starts, so the
+    # report is spooled to disk rather than held in memory
+    report = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode="w+")
+    async for line in importer.import_users(
+        conn, importer.iter_lines(request.stream()), fmt=fmt
+    ):
+        report.write(json.dumps(line) + "\n")
+    report.seek(0)
+    return StreamingResponse(
+        report,
+        media_type="application/x-ndjson",
+        background=BackgroundTask(report.close),
+    )
+
+
+async def delete_user(
+    idx: UUID4,
+    db: AsyncSession = Depends(database.get_session),
+    current_user: int = Depends(oauth2.get_current_user),
+):
+    if idx != current_user.id:
+        await _raise_not_found_or_forbidden(db, idx)
+    result = await db.execute(
+        delete(models.User).where(models.User.id == idx).returning(models.User.id)
+    )
+    deleted = result.first()
+    await db.commit()
+    if deleted is None:
+        raise _not_found(idx)
+    oauth2.invalidate_user(idx)
+    database.mark_written()
+    if config.settings.email_filter:
+        emails.get_email_filter().removed()
+    audit.record("user_deleted", user_id=idx, actor_id=current_user.id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-def update_user(
+async def update_user(
     idx: UUID4,
     updated_user: schemas.UserCreate,
-    db: Session = Depends(database.get_session),
+    db: AsyncSession = Depends(database.get_session),
     current_user: int = Depends(oauth2.get_current_user),
 ):
-    user_query = db.query(models.User).filter(models.User.id == idx)
-    user = user_query.first()
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with id: {idx} does not exist",
-        )
-    if user.id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to perform requested action",
+    if idx != current_user.id:
+        await _raise_not_found_or_forbidden(db, idx)
+    updated_user.password = await utils.hash_pass(updated_user.password)
+    try:
+        result = await db.execute(
+            update(models.User)
+            .where(models.User.id == idx)
+            .values(**updated_user.dict(), updated_at=func.now())
+            .returning(*USER_OUT_COLUMNS)
+            .execution_options(synchronize_session=False)
         )
-    user_query.update(updated_user.dict(), synchronize_session=False)
-    db.commit()
-
-    return user_query.first()
+        user = result.first()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise _email_taken(updated_user.email)
+    if user is None:
+        raise _not_found(idx)
+    oauth2.invalidate_user(idx)
+    database.mark_written()
+    if config.settings.email_filter:
+        # the old email may be gone; other workers learn the new one from
+        # `updated_at` at their next sync
+        email_filter = emails.get_email_filter()
+        email_filter.add(user.email)
+        email_filter.removed()
+    return user
 
 
-def admin_access(
+async def admin_access(
     user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"])
 ):
     return [{"item_id": "Foo", "owner": user.email}]
 
 
-def update_user_permission(
+async def update_user_permission(
     scope: str = Query(...),
     denied_access: bool = Query(...),
     idx: UUID4 = Path(...),
-    db: Session = Depends(database.get_session),
+    db: AsyncSession = Depends(database.get_session),
     current_user: schemas.UserOut = Security(oauth2.get_current_user, scopes=["admin"]),
 ) -> Dict:
     """
-    User scopes:
+    User scopes are roles or single permissions, see `app.permissions`:
     - registered: account created, email does not confirm yet
-    - confirmed: email confirmed
-    - admin: account has admin permission
+    - confirmed: email confirmed, includes registered
+    - admin: account has admin permission, includes confirmed
 
     Update user permissions by adding or removing scopes
     :param idx: id of user to update rights
-    :param scope: string scope adding to user scopes
-                   options: ["admin"]
+    :param scope: role or permission to add to or remove from user scopes
     :param db: database session
     :param current_user: check current user permissions, should have `admin` scopes
     :param denied_access: False if enable access, True if denied
     :return dict `user_id`: user_id, `scopes`: user_scopes
     """
-    current_user_id = current_user.id
+    if not permissions.is_known(scope):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown scope: {scope}",
+        )
     if denied_access:
-        user = disable_access(idx, db)
+        user = await disable_access(idx, scope, db)
     else:
-        user = enable_access(idx, scope, db)
-    return {"user_id": user.id, "scopes": [scope]}
+        user = await enable_access(idx, scope, db)
+    audit.record(
+        "permission_changed",
+        user_id=idx,
+        actor_id=current_user.id,
+        scope=scope,
+        granted=not denied_access,
+    )
+    return {"user_id": user.id, "scopes": user.scopes}
 
 
-def enable_access(
+async def enable_access(
     idx: UUID4,
     scope: str,
-    db: Session,
+    db: AsyncSession,
 ):
     """
-    Enable user access by adding scopes
+    Enable user access by adding a scope, keeping the others
     :param idx: id of user to update rights
-    :param scope: string scope adding to user scopes
-                   options: ["admin"]
+    :param scope: role or permission adding to user scopes
     :param db: database session
     :return: user
     """
-    user_query = db.query(models.User).filter(models.User.id == idx)
-    user = user_query.first()
+    # remove first so a scope the user already has is not duplicated
+    scopes = func.array_remove(models.User.scopes, scope)
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == idx)
+        .values({"scopes": func.array_append(scopes, scope), "updated_at": func.now()})
+        .returning(*USER_OUT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    user = result.first()
+    await db.commit()
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with id: {idx} does not exist",
-        )
-    user_query.update({"scopes": [scope]}, synchronize_session=False)
-    db.commit()
+        raise _not_found(idx)
+    oauth2.invalidate_user(idx)
+    database.mark_written()
     return user
 
 
-def disable_access(
+async def disable_access(
     idx: UUID4,
-    db: Session,
+    scope: str,
+    db: AsyncSession,
 ):
     """
-    Disable user access by removing scopes
+    Disable user access by removing a scope
     :param idx: id of user to update rights
+    :param scope: role or permission removing from user scopes
     :param db: database session
     :return: user
     """
-    user_query = db.query(models.User).filter(models.User.id == idx)
-    user = user_query.first()
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with id: {idx} does not exist",
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == idx)
+        .values(
+            {
+                "scopes": func.array_remove(models.User.scopes, scope),
+                "updated_at": func.now(),
+            }
         )
-    user_query.update({"scopes": []}, synchronize_session=False)
-    db.commit()
+        .returning(*USER_OUT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    user = result.first()
+    await db.commit()
+    if user is None:
+        raise _not_found(idx)
+    oauth2.invalidate_user(idx)
+    database.mark_written()
     return user
+
+
+def _not_found(idx: UUID4) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"User with id: {idx} does not exist",
+    )
+
+
+def _email_taken(email: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"User with email: {email} already exists",
+    )
+
+
+async def _raise_not_found_or_forbidden(db: AsyncSession, idx: UUID4):
+    """Failure path of a write to someone else's account: 404 or 403"""
+    if await db.scalar(select(models.User.id).where(models.User.id == idx)) is None:
+        raise _not_found(idx)
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Not authorized to perform requested action",
+    )
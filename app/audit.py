@@ -0,0 +1,234 @@
+"""
+Audit trail of authentication events, written in the background.
+
+`record` only appends to a bounded in-memory queue, so logging a login
+costs no database round trip. A writer thread flushes the queue to
+`audit_events` in multi-row INSERTs once `batch_size` events are waiting or
+`flush_interval` seconds have passed, and drains it on `close`. When the
+queue is full the `overflow` policy decides:
+
+- `drop_newest`: the new event is dropped
+- `drop_oldest`: the oldest queued event is dropped to make room
+
+`record` runs on the event loop in both database modes, so it never waits
+for room.
+
+Dropped and failed events are counted in `stats()`. A writer that died is
+started again by the next `record`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from sqlalchemy import insert
+
+from app import config, database, models
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest")
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    def __init__(
+        self,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow: str = "drop_newest",
+        engine=None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown audit overflow policy: {overflow}")
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.engine = engine
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._flushing = False
+        self._writing = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_error = None
+
+    def record(self, event: str, user_id=None, actor_id=None, ip=None, **detail):
+        """
+        Queue an event
+        :param event: what happened, e.g. `login` or `login_failed`
+        :param user_id: user the event is about
+        :param actor_id: user who caused it
+        :param ip: client address
+        :param detail: anything else, stored as JSON
+        :return False if the event was dropped
+        """
+        row = {
+            "created_at": datetime.now(timezone.utc),
+            "event": event,
+            "user_id": user_id,
+            "actor_id": actor_id,
+            "ip": ip,
+            # ids and dates as strings, so one event cannot fail its batch
+            "detail": json.loads(json.dumps(detail, default=str)) if detail else None,
+        }
+        with self._cond:
+            if self._closed:
+                self._dropped += 1
+                return False
+            if len(self._events) >= self.queue_size and not self._make_room():
+                self._dropped += 1
+                return False
+            self._events.append(row)
+            if len(self._events) >= self.batch_size:
+                self._cond.notify_all()
+            self._start_writer()
+        return True
+
+    def _start_writer(self):
+        # called holding the lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="audit-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _make_room(self) -> bool:
+        if self.overflow == "drop_oldest":
+            self._events.popleft()
+            self._dropped += 1
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed
+                    or self._flushing
+                    or len(self._events) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                count = min(len(self._events), self.batch_size)
+                batch = [self._events.popleft() for _ in range(count)]
+                self._writing += len(batch)
+                if not self._events:
+                    self._flushing = False
+                closed = self._closed
+                self._cond.notify_all()
+            if batch:
+                self._write(batch, retry=not closed)
+            if closed and not self._events:
+                return
+
+    def _write(self, batch: list, retry: bool):
+        try:
+            with (self.engine or database.get_engine()).begin() as conn:
+                conn.execute(insert(models.AuditEvent.__table__), batch)
+            written, failed = len(batch), 0
+        except Exception as exc:
+            # anything, so the writer survives to retry or count the batch
+            logger.exception("Writing %d audit events failed", len(batch))
+            written, failed = 0, len(batch)
+            self._last_error = str(exc)
+        with self._cond:
+            self._writing -= len(batch)
+            if failed and retry:
+                # back to the front, as far as the queue has room
+                room = self.queue_size - len(self._events)
+                self._events.extendleft(reversed(batch[:room]))
+                failed -= min(room, len(batch))
+            self._written += written
+            self._failed += failed
+            self._batches += bool(written)
+            self._cond.notify_all()
+        if not written and retry:
+            time.sleep(self.flush_interval)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Write every queued event now; False if `timeout` ran out first"""
+        with self._cond:
+            if not self._events and not self._writing:
+                return True
+            self._start_writer()
+            self._flushing = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._events and not self._writing, timeout=timeout
+            )
+
+    def close(self, timeout: float = None):
+        """
+        Stop taking events and drain the queue. Once drained the log takes
+        events again, with a new writer started on first use
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return
+        with self._cond:
+            self._thread = None
+            self._closed = False
+
+    def after_fork(self):
+        """In a forked child: the writer thread did not survive the fork"""
+        self.__init__(
+            self.queue_size,
+            self.batch_size,
+            self.flush_interval,
+            self.overflow,
+            self.engine,
+        )
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._events),
+                "queue_size": self.queue_size,
+                "overflow": self.overflow,
+                "written": self._written,
+                "batches": self._batches,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "last_error": self._last_error,
+            }
+
+
+@lru_cache()
+def get_audit_log() -> AuditLog:
+    settings = config.get_settings()
+    return AuditLog(
+        queue_size=settings.audit_queue_size,
+        batch_size=settings.audit_batch_size,
+        flush_interval=settings.audit_flush_seconds,
+        overflow=settings.audit_overflow,
+    )
+
+
+def _reset_after_fork():
+    if get_audit_log.cache_info().currsize:
+        get_audit_log().after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def record(event: str, **fields) -> bool:
+    """Queue an event on this worker's audit log, see `AuditLog.record`"""
+    return get_audit_log().record(event, **fields)
+
+
+__getattr__ = config.lazy_attributes(__name__, {"audit_log": get_audit_log})
@@ -0,0 +1,42 @@
+import math
+
+
+class BloomFilter:
+    """
+    Per-process Bloom filter over strings.
+
+    Positions come from the built-in `hash()`, which is salted per process,
+    so a filter must be rebuilt in every worker rather than shared. A miss is
+    definite; a hit has to be confirmed against the real data.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        bits = -self.capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(int(math.ceil(bits)), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        value = hash(item)
+        low, high = value & 0xFFFFFFFF, (value >> 32) & 0xFFFFFFFF | 1
+        size = self.size
+        return [(low + i * high) % size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        bits = self._bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        value = hash(item)
+        low, high = value & 0xFFFFFFFF, (value >> 32) & 0xFFFFFFFF | 1
+        bits, size = self._bits, self.size
+        for i in range(self.hashes):
+            position = (low + i * high) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
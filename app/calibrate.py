@@ -0,0 +1,78 @@
+"""
+Bcrypt cost calibration.
+
+Times a password verify at increasing bcrypt rounds on this machine and
+suggests the highest cost whose verify stays within the target latency:
+
+    python -m app.calibrate --target-ms 250
+
+Put the result in `BCRYPT_ROUNDS`; existing hashes are moved to the new cost
+as their users log in.
+"""
+import argparse
+import statistics
+import time
+
+from passlib.hash import bcrypt
+
+# bcrypt's own bounds on the cost parameter
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
+
+def time_verify(rounds: int, samples: int = 3) -> float:
+    """Median seconds one verify takes at `rounds`"""
+    handler = bcrypt.using(rounds=rounds)
+    password_hash = handler.hash("calibration password")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.verify("calibration password", password_hash)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def choose_rounds(timings: dict, target: float) -> int:
+    """
+    Highest measured cost within `target` seconds, or the lowest measured
+    one when none is fast enough
+    :param timings: rounds -> seconds per verify
+    :param target: latency budget of one verify, in seconds
+    """
+    within = [rounds for rounds, seconds in timings.items() if seconds <= target]
+    return max(within) if within else min(timings)
+
+
+def calibrate(target: float, min_rounds: int, max_rounds: int, samples: int):
+    """
+    Measure from `min_rounds` up, stopping at the first cost over `target`:
+    each extra round doubles the work, so there is no point going further
+    :return rounds -> seconds per verify
+    """
+    timings = {}
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings[rounds] = time_verify(rounds, samples)
+        if timings[rounds] > target:
+            break
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost")
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args(argv)
+    if not MIN_ROUNDS <= args.min_rounds <= args.max_rounds <= MAX_ROUNDS:
+        parser.error(f"rounds must be within {MIN_ROUNDS}..{MAX_ROUNDS}")
+
+    target = args.target_ms / 1000
+    timings = calibrate(target, args.min_rounds, args.max_rounds, args.samples)
+    for rounds, seconds in timings.items():
+        print(f"rounds={rounds:<3} verify={seconds * 1000:.1f}ms")
+    print(f"BCRYPT_ROUNDS={choose_rounds(timings, target)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
-from pydantic import BaseSettings
+import sys
+from functools import lru_cache
+
+from pydantic import BaseSettings, root_validator
 
 
 class Settings(BaseSettings):
@@ -10,9 +13,97 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
+    refresh_token_expire_days: int = 30
+    revocation_sync_seconds: float = 5
+    revocation_filter_capacity: int = 100000
+    database_async: bool = True
+    database_replicas: str = ""
+    replica_check_seconds: float = 5
+    replica_check_timeout: float = 1
+    replica_max_lag_seconds: float = 10
+    replica_sticky_seconds: float = 10
+    audit_queue_size: int = 10000
+    audit_batch_size: int = 500
+    audit_flush_seconds: float = 1
+    audit_overflow: str = "drop_newest"
+    audit_query_max_limit: int = 1000
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = True
+    db_pgbouncer: bool = False
+    hash_pool_size: int = 0
+    hash_queue_size: int = 64
+    bcrypt_rounds: int = 12
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 30
+    token_cache_size: int = 10000
+    batch_get_max_ids: int = 100
+    introspect_max_tokens: int = 100
+    list_users_max_limit: int = 1000
+    fast_responses: bool = False
+    import_chunk_size: int = 1000
+    import_hash_workers: int = 0
+    jwt_keys_dir: str = "keys"
+    jwt_key_publish_delay: int = 300
+    jwt_keys_reload_seconds: int = 60
+    jwt_backend: str = "jose"
+    login_throttle_backend: str = "memory"
+    login_rate_per_email: int = 10
+    login_rate_per_ip: int = 100
+    login_rate_window: int = 60
+    login_throttle_max_keys: int = 100000
+    prewarm: bool = True
+    email_filter: bool = False
+    email_filter_capacity: int = 1000000
+    email_filter_sync_seconds: float = 1
+    profiling: bool = False
+    profiling_dir: str = "profiles"
+    profiling_sample_rate: float = 0
+    profiling_min_ms: float = 0
+    profiling_max_files: int = 100
+    slow_query_ms: float = 0
+    slow_query_log_size: int = 100
 
     class Config:
         env_file = ".env"
 
+    @root_validator
+    def pgbouncer_uses_psycopg2(cls, values):
+        # SQLAlchemy's asyncpg dialect always prepares named statements, which
+        # collide on server connections shared under transaction pooling
+        if values.get("db_pgbouncer"):
+            values["database_async"] = False
+        return values
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
+
+
+def lazy_attributes(module_name: str, factories: dict):
+    """
+    Module `__getattr__` creating each attribute of `factories` on first
+    access, then keeping it as a plain module attribute. Module state built
+    from the settings is created this way, so importing the app reads no
+    `.env` and opens no pools.
+    """
+    module = sys.modules[module_name]
+
+    def __getattr__(name):
+        try:
+            factory = factories[name]
+        except KeyError:
+            raise AttributeError(
+                f"module {module_name!r} has no attribute {name!r}"
+            ) from None
+        value = factory()
+        setattr(module, name, value)
+        return value
+
+    return __getattr__
+
 
-settings = Settings()
+__getattr__ = lazy_attributes(__name__, {"settings": get_settings})
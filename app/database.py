@@ -1,27 +1,411 @@
-from sqlalchemy import create_engine
+import math
+import os
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql import Select
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
 
-from app.config import settings
+from app import config, metrics, replicas
+
+
+def _server_uri() -> str:
+    settings = config.get_settings()
+    return (
+        f"postgresql://{settings.database_username}:{settings.database_password}@"
+        f"{settings.database_hostname}:{settings.database_port}/"
+    )
+
+
+def _db_uri() -> str:
+    return f"{_server_uri()}{config.get_settings().database_name}"
+
+
+def _async_uri(uri: str) -> str:
+    return uri.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+def _async_db_uri() -> str:
+    return _async_uri(_db_uri())
+
+
+def _replica_uris() -> list:
+    return [
+        uri.strip()
+        for uri in config.get_settings().database_replicas.split(",")
+        if uri.strip()
+    ]
+
+
+def _pool_options(poolclass) -> dict:
+    """Engine pool arguments from the settings; a pool size of 0 disables pooling"""
+    settings = config.get_settings()
+    if settings.db_pool_size == 0:
+        return {"poolclass": NullPool}
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def _async_engine_options(uri: str = None) -> dict:
+    """
+    Behind PgBouncer requests go through psycopg2, only the raw asyncpg
+    connections of `get_raw_connection` use this engine. asyncpg must not
+    keep prepared statements around between their transactions, which may
+    run on different server connections
+    """
+    uri = uri or _async_db_uri()
+    if not config.get_settings().db_pgbouncer:
+        return {"url": uri}
+    return {
+        "url": make_url(uri).update_query_dict({"prepared_statement_cache_size": "0"}),
+        "connect_args": {"statement_cache_size": 0},
+    }
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            max_overflow=config.get_settings().db_max_overflow,
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            timeout=pool.timeout(),
+        )
+    return stats
+
+
+@lru_cache()
+def get_engine():
+    engine = create_engine(_db_uri(), **_pool_options(metrics.TimedQueuePool))
+    metrics.instrument_engine(engine, "sync")
+    return engine
+
+
+@lru_cache()
+def get_async_engine():
+    engine = create_async_engine(
+        **_async_engine_options(), **_pool_options(metrics.TimedAsyncAdaptedQueuePool)
+    )
+    metrics.instrument_engine(engine.sync_engine, "async")
+    return engine
+
+
+@lru_cache()
+def get_sessionmaker():
+    return sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=get_engine()
+    )
+
+
+@lru_cache()
+def get_async_sessionmaker():
+    return sessionmaker(
+        bind=get_async_engine(),
+        class_=AsyncSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+@lru_cache()
+def get_replica_set() -> replicas.ReplicaSet:
+    """
+    Replicas of `DATABASE_REPLICAS`, with engines of the driver in use. A
+    replica whose connection breaks is taken out until the next check
+    """
+    settings = config.get_settings()
+    engines = []
+    for index, uri in enumerate(_replica_uris()):
+        if settings.database_async:
+            engine = create_async_engine(
+                **_async_engine_options(_async_uri(uri)),
+                **_pool_options(metrics.TimedAsyncAdaptedQueuePool),
+            )
+            metrics.instrument_engine(engine.sync_engine, f"async_replica{index}")
+        else:
+            engine = create_engine(uri, **_pool_options(metrics.TimedQueuePool))
+            metrics.instrument_engine(engine, f"replica{index}")
+        engines.append(engine)
+    replica_set = replicas.ReplicaSet(
+        engines,
+        check_interval=settings.replica_check_seconds,
+        max_lag=settings.replica_max_lag_seconds,
+        timeout=settings.replica_check_timeout,
+    )
+
+    def replica_failed(context):
+        # a lost or refused connection; the next check decides when it is back
+        if context.is_disconnect or context.connection is None:
+            replica_set.mark_down(context.engine)
+
+    for engine in engines:
+        event.listen(
+            getattr(engine, "sync_engine", engine), "handle_error", replica_failed
+        )
+    return replica_set
+
+
+class RoutingSession(Session):
+    """
+    `Session` of `get_read_session`: plain SELECTs go to the engine in
+    `info["replica"]` when there is one, anything else to the primary it is
+    bound to. After its first write the session reads from the primary too,
+    so a request sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing:
+            if isinstance(clause, Select) and clause._for_update_arg is None:
+                return replica
+            self.info["replica"] = None
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@lru_cache()
+def get_read_sessionmaker():
+    return sessionmaker(
+        class_=RoutingSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=get_engine(),
+    )
+
+
+@lru_cache()
+def get_async_read_sessionmaker():
+    return sessionmaker(
+        bind=get_async_engine(),
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+# the time of the client's last write, so any worker serving its next
+# requests reads from the primary until the replicas have caught up
+WRITE_COOKIE = "last_write"
+# per request, set by `ReadYourWritesMiddleware`
+_request_writes = ContextVar("request_writes", default=None)
+
+
+def mark_written():
+    """
+    Send the reads of the client of this request to the primary for
+    `REPLICA_STICKY_SECONDS`, so it sees what the request wrote
+    """
+    writes = _request_writes.get()
+    if writes is not None:
+        writes["written"] = True
 
-DB_URI = (
-    f"postgresql://{settings.database_username}:{settings.database_password}@"
-    f"{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
-)
 
-DB_URI_TEST = (
-    f"postgresql://{settings.database_username}:{settings.database_password}@"
-    f"{settings.database_hostname}:{settings.database_port}/"
+def reads_own_writes(request: Request) -> bool:
+    """The client wrote within `REPLICA_STICKY_SECONDS`"""
+    try:
+        written_at = float(request.cookies.get(WRITE_COOKIE, ""))
+    except ValueError:
+        return False
+    return time.time() - written_at < config.get_settings().replica_sticky_seconds
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pure ASGI middleware setting the `last_write` cookie on responses to
+    requests that called `mark_written`. The cookie travels with the
+    client, so it holds whichever worker serves the next request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        writes = {"written": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and writes["written"]:
+                sticky = config.get_settings().replica_sticky_seconds
+                cookie = (
+                    f"{WRITE_COOKIE}={time.time():.3f}; Max-Age={math.ceil(sticky)}; "
+                    "Path=/; HttpOnly; SameSite=lax"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"set-cookie", cookie.encode("latin-1")),
+                ]
+            await send(message)
+
+        token = _request_writes.set(writes)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_writes.reset(token)
+
+
+def created_engines() -> list:
+    """Sync engines created so far in this process"""
+    engines = []
+    if get_engine.cache_info().currsize:
+        engines.append(get_engine())
+    if get_async_engine.cache_info().currsize:
+        engines.append(get_async_engine().sync_engine)
+    if get_replica_set.cache_info().currsize:
+        for engine in get_replica_set().engines:
+            engines.append(getattr(engine, "sync_engine", engine))
+    return engines
+
+
+def _dispose_after_fork():
+    # a worker forked from a preloaded parent must not share its connections;
+    # close=False leaves them open for the parent and starts an empty pool
+    for engine in created_engines():
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_after_fork)
+
+__getattr__ = config.lazy_attributes(
+    __name__,
+    {
+        "DB_URI": _db_uri,
+        "DB_URI_TEST": _server_uri,
+        "ASYNC_DB_URI": _async_db_uri,
+        "engine": get_engine,
+        "async_engine": get_async_engine,
+        "SessionLocal": get_sessionmaker,
+        "AsyncSessionLocal": get_async_sessionmaker,
+    },
 )
 
-engine = create_engine(DB_URI)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
-def get_session():
-    db = SessionLocal()
+class ThreadedSession:
+    """
+    Blocking `Session` exposed through the awaitable `AsyncSession` API.
+
+    Every database call is sent to the threadpool, so handlers can be written
+    once against `AsyncSession` and still run on the psycopg2 driver when
+    `settings.database_async` is off.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def info(self) -> dict:
+        return self.sync_session.info
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    async def execute(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.execute, statement, params)
+
+    async def scalar(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params)
+
+    async def stream(self, statement, params=None):
+        result = await run_in_threadpool(
+            self.sync_session.execute,
+            statement.execution_options(stream_results=True),
+            params,
+        )
+        return ThreadedResult(result)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+class ThreadedResult:
+    """Server-side cursor result read through the `AsyncResult` API."""
+
+    def __init__(self, result):
+        self.result = result
+
+    def scalars(self):
+        return ThreadedResult(self.result.scalars())
+
+    async def partitions(self, size=None):
+        while True:
+            partition = await run_in_threadpool(self.result.fetchmany, size)
+            if not partition:
+                return
+            yield partition
+
+
+async def get_session():
+    if config.get_settings().database_async:
+        async with get_async_sessionmaker()() as db:
+            yield db
+        return
+    db = ThreadedSession(get_sessionmaker()())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def get_read_session(request: Request):
+    """
+    Session for read mostly routes: plain SELECTs go to a healthy replica,
+    round robin, writes and everything after them to the primary. With no
+    healthy replica, or for a client that just wrote, it is an ordinary
+    primary session.
+    """
+    replica = None
+    if not reads_own_writes(request):
+        replica = await get_replica_set().choose()
+    if config.get_settings().database_async:
+        async with get_async_read_sessionmaker()() as db:
+            db.info["replica"] = replica.sync_engine if replica else None
+            yield db
+        return
+    db = ThreadedSession(get_read_sessionmaker()())
+    db.info["replica"] = replica
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_raw_connection():
+    """asyncpg connection from the async pool, for COPY and other driver calls."""
+    async with get_async_engine().connect() as conn:
+        raw = await conn.get_raw_connection()
+        yield raw.driver_connection
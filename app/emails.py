@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config, database, models
+from app.bloom import BloomFilter
+
+# seconds re-read on every sync, so users committed slightly out of order
+# are still picked up
+SYNC_OVERLAP = 30
+STREAM_PARTITION = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(email: str) -> str:
+    return email.lower()
+
+
+class EmailFilter:
+    """
+    Registered emails of this worker, lowercased, in a Bloom filter.
+
+    `might_exist` answering False is a definite miss, so lookups of unknown
+    emails can skip the database. Users created or renamed by other workers
+    arrive with the next `sync`, at most `sync_interval` seconds later.
+    Deleted emails cannot be taken out of a Bloom filter; they only cost a
+    false positive, and the filter is rebuilt once they make up a quarter of
+    it. Rebuilds read the whole `users` table, so they run in a background
+    thread on `engine`, while lookups keep using the old filter.
+    """
+
+    def __init__(self, capacity: int, sync_interval: float, engine=None):
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self.engine = engine
+        self._filter = None
+        self._removed = 0
+        self._synced_at = None
+        self._syncing = False
+        self._rebuilt_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_exist(self, email: str) -> bool:
+        return self._filter is None or normalize(email) in self._filter
+
+    def add(self, email: str):
+        email = normalize(email)
+        if self._filter is not None and email not in self._filter:
+            self._filter.add(email)
+
+    def removed(self):
+        """An email was deleted or renamed"""
+        with self._lock:
+            self._removed += 1
+
+    @property
+    def needs_sync(self) -> bool:
+        if self._syncing:
+            return False
+        return (
+            self._synced_at is None
+            or time.monotonic() - self._synced_at >= self.sync_interval
+        )
+
+    @property
+    def needs_rebuild(self) -> bool:
+        if self._filter is None:
+            return True
+        return (
+            self._removed > self._filter.count // 4
+            or self._filter.count > self._filter.capacity
+        )
+
+    async def sync(self, db: AsyncSession):
+        if self.needs_rebuild:
+            self._start_rebuild()
+        if self._filter is None:
+            # every lookup goes to the database until the first build is in
+            return
+        self._syncing = True
+        try:
+            started = time.monotonic()
+            synced_at = self._synced_at
+            window = timedelta(seconds=started - synced_at + SYNC_OVERLAP)
+            users = models.User.__table__
+            result = await db.execute(
+                select(func.lower(users.c.email)).where(
+                    or_(
+                        users.c.created_at > func.now() - window,
+                        users.c.updated_at > func.now() - window,
+                    )
+                )
+            )
+            for email in result.scalars():
+                self.add(email)
+            with self._lock:
+                # unless a rebuild moved it back meanwhile
+                if self._synced_at == synced_at:
+                    self._synced_at = started
+        finally:
+            self._syncing = False
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run_rebuild, name="email-filter-rebuild", daemon=True
+            )
+            self._thread.start()
+
+    def _run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            # tried again at the next sync
+            logger.exception("Rebuilding the email filter failed")
+
+    def rebuild(self):
+        """
+        Build a new filter from every registered email and swap it in.
+        Blocking; run at startup and, by `sync`, in a background thread
+        """
+        started = time.monotonic()
+        with self._lock:
+            count = self._filter.count if self._filter is not None else 0
+            removed = self._removed
+        bloom = BloomFilter(max(self.capacity, 2 * (count - removed)))
+        query = select(func.lower(models.User.email)).execution_options(
+            stream_results=True
+        )
+        with (self.engine or database.get_engine()).connect() as conn:
+            for emails in conn.execute(query).scalars().partitions(STREAM_PARTITION):
+                for email in emails:
+                    bloom.add(email)
+        with self._lock:
+            self._filter = bloom
+            self._removed -= removed
+            self._rebuilt_at = started
+            # emails added to the old filter while this one was built are
+            # read again by the next sync
+            if self._synced_at is None or self._synced_at > started:
+                self._synced_at = started
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "entries": self._filter.count if self._filter is not None else 0,
+            "filter_bits": self._filter.size if self._filter is not None else 0,
+            "removed_since_rebuild": self._removed,
+            "synced_seconds_ago": (
+                None if self._synced_at is None else time.monotonic() - self._synced_at
+            ),
+            "rebuilt_seconds_ago": (
+                None
+                if self._rebuilt_at is None
+                else time.monotonic() - self._rebuilt_at
+            ),
+        }
+
+
+async def synced_filter(db: AsyncSession) -> Optional[EmailFilter]:
+    """The email filter brought up to date, None when `EMAIL_FILTER` is off"""
+    if not config.get_settings().email_filter:
+        return None
+    email_filter = get_email_filter()
+    if email_filter.needs_sync:
+        await email_filter.sync(db)
+    return email_filter
+
+
+@lru_cache()
+def get_email_filter() -> EmailFilter:
+    settings = config.get_settings()
+    return EmailFilter(
+        capacity=settings.email_filter_capacity,
+        sync_interval=settings.email_filter_sync_seconds,
+    )
+
+
+__getattr__ = config.lazy_attributes(__name__, {"email_filter": get_email_filter})
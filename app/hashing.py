@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class HashingQueueFull(Exception):
+    pass
+
+
+def _timed_call(func, *args):
+    started = time.monotonic()
+    result = func(*args)
+    return started, time.monotonic(), result
+
+
+class HashingExecutor:
+    """
+    Bounded process pool for CPU-bound password hashing.
+
+    At most `max_workers + queue_size` calls are in flight at once; any call
+    beyond that raises `HashingQueueFull` immediately instead of waiting.
+    The pool is started on first use, so importing this module (or forking
+    a preloaded worker) does not spawn processes. A pool broken by a dead
+    process (OOM kill, crash) is replaced, and the call retried once.
+    """
+
+    def __init__(self, max_workers: int = 0, queue_size: int = 0):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._restarts = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._hash_time_total = 0.0
+        self._hash_time_max = 0.0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def _drop_pool(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is not pool:
+                # already replaced by another call
+                return
+            self._pool = None
+            self._restarts += 1
+        pool.shutdown(wait=False)
+
+    async def _submit(self, func, *args):
+        pool = self._get_pool()
+        try:
+            return await asyncio.wrap_future(pool.submit(_timed_call, func, *args))
+        except BrokenProcessPool:
+            self._drop_pool(pool)
+            raise
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.queue_size:
+                self._rejected += 1
+                raise HashingQueueFull()
+            self._pending += 1
+        try:
+            submitted = time.monotonic()
+            try:
+                started, finished, result = await self._submit(func, *args)
+            except BrokenProcessPool:
+                started, finished, result = await self._submit(func, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self._record(started - submitted, finished - started)
+        return result
+
+    def _record(self, queue_wait: float, hash_time: float):
+        with self._lock:
+            self._completed += 1
+            self._queue_wait_total += queue_wait
+            self._queue_wait_max = max(self._queue_wait_max, queue_wait)
+            self._hash_time_total += hash_time
+            self._hash_time_max = max(self._hash_time_max, hash_time)
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "workers": self.max_workers,
+                "queue_size": self.queue_size,
+                "pending": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "restarts": self._restarts,
+                "queue_wait_avg_ms": self._queue_wait_total / completed * 1000,
+                "queue_wait_max_ms": self._queue_wait_max * 1000,
+                "hash_time_avg_ms": self._hash_time_total / completed * 1000,
+                "hash_time_max_ms": self._hash_time_max * 1000,
+            }
+
+    def after_fork(self):
+        """In a forked child: forget the parent's processes and counters"""
+        self.__init__(self.max_workers, self.queue_size)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
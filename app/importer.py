@@ -0,0 +1,242 @@
+"""
+Bulk user import.
+
+Rows are read one line at a time (NDJSON objects, or CSV with a header line)
+with `email` and either a plain `password` or an already hashed
+`password_hash`, plus optional `scopes` (a list, or space separated in CSV).
+Every `chunk_size` rows the plain passwords are hashed in the shared hashing
+pool, the chunk is COPYed into a temporary table and moved into `users` with one
+INSERT ... ON CONFLICT DO NOTHING. Memory use depends on the chunk size only.
+
+The report is a stream of dicts: one per rejected row, then a summary.
+
+    python -m app.importer users.ndjson > report.ndjson
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Iterable
+
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app import config, database, permissions, schemas, utils
+from app.hashing import HashingExecutor, HashingQueueFull
+
+STAGING_TABLE = "users_import"
+# the hashing pool also serves logins and sign-ups; an import waits its turn
+QUEUE_FULL_RETRY_SECONDS = 0.05
+
+CREATE_STAGING = f"""
+CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (
+    line integer NOT NULL,
+    email text NOT NULL,
+    password text NOT NULL,
+    scopes text[]
+) ON COMMIT DELETE ROWS
+"""
+
+MOVE_STAGED = f"""
+INSERT INTO users (email, password, scopes)
+SELECT email, password, COALESCE(scopes, '{{}}')
+FROM (
+    SELECT DISTINCT ON (email) email, password, scopes
+    FROM {STAGING_TABLE}
+    ORDER BY email, line
+) AS staged
+ON CONFLICT (lower(email)) DO NOTHING
+RETURNING email
+"""
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_file_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    for line in lines:
+        yield line
+
+
+async def _parse(lines: AsyncIterator[str], fmt: str):
+    header = None
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if fmt == "csv":
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = values
+                    continue
+                row = dict(zip(header, values))
+                row["scopes"] = row.get("scopes", "").split() or None
+                row = {key: value for key, value in row.items() if value != ""}
+            else:
+                row = json.loads(line)
+            user = schemas.UserImport(**row)
+        except (ValueError, TypeError, ValidationError) as exc:
+            yield line_number, None, str(exc)
+            continue
+        unknown = [
+            scope for scope in user.scopes or () if not permissions.is_known(scope)
+        ]
+        if (user.password is None) == (user.password_hash is None):
+            yield line_number, None, "exactly one of password, password_hash needed"
+        elif user.password == "":
+            yield line_number, None, "password must not be empty"
+        elif unknown:
+            yield line_number, None, f"unknown scopes: {', '.join(unknown)}"
+        elif user.password is None and not utils.pwd_context.identify(
+            user.password_hash
+        ):
+            yield line_number, None, "password_hash is not a supported hash"
+        else:
+            yield line_number, user, None
+
+
+async def _hash_many(executor: HashingExecutor, passwords: list) -> list:
+    while True:
+        try:
+            return await executor.run(utils._hash_many, passwords)
+        except HashingQueueFull:
+            await asyncio.sleep(QUEUE_FULL_RETRY_SECONDS)
+
+
+async def _hash_chunk(executor: HashingExecutor, chunk: list, workers: int):
+    plain = [
+        index for index, (_, user) in enumerate(chunk) if user.password is not None
+    ]
+    if not plain:
+        return
+    size = -(-len(plain) // workers)
+    slices = [plain[start : start + size] for start in range(0, len(plain), size)]
+    hashed = await asyncio.gather(
+        *(
+            _hash_many(executor, [chunk[i][1].password for i in indexes])
+            for indexes in slices
+        )
+    )
+    for indexes, hashes in zip(slices, hashed):
+        for index, password_hash in zip(indexes, hashes):
+            chunk[index][1].password_hash = password_hash
+
+
+async def _load_chunk(conn, chunk: list):
+    async with conn.transaction():
+        await conn.copy_records_to_table(
+            STAGING_TABLE,
+            records=[
+                (line, user.email, user.password_hash, user.scopes)
+                for line, user in chunk
+            ],
+            columns=["line", "email", "password", "scopes"],
+        )
+        inserted = {row["email"] for row in await conn.fetch(MOVE_STAGED)}
+    duplicates = []
+    for line, user in chunk:
+        if user.email in inserted:
+            inserted.discard(user.email)
+        else:
+            duplicates.append(
+                {"line": line, "email": user.email, "error": "duplicate email"}
+            )
+    return len(chunk) - len(duplicates), duplicates
+
+
+async def import_users(
+    conn,
+    lines: AsyncIterator[str],
+    fmt: str = "ndjson",
+    chunk_size: int = None,
+    workers: int = None,
+) -> AsyncIterator[dict]:
+    """
+    Import users from `lines` over the asyncpg connection `conn`
+    :param conn: asyncpg connection, used for COPY
+    :param lines: NDJSON or CSV lines
+    :param fmt: "ndjson" or "csv"
+    :param chunk_size: rows hashed and copied per transaction
+    :param workers: most hashing processes of the shared pool used at once
+    :return: report dicts, one per rejected row and a final summary
+    """
+    chunk_size = chunk_size or config.settings.import_chunk_size
+    executor = utils.get_hashing_executor()
+    workers = min(
+        workers or config.settings.import_hash_workers or executor.max_workers,
+        executor.max_workers,
+    )
+    summary = {"imported": 0, "duplicates": 0, "invalid": 0}
+    await conn.execute(CREATE_STAGING)
+    chunk = []
+    async for line, user, error in _parse(lines, fmt):
+        if error:
+            summary["invalid"] += 1
+            yield {"line": line, "error": error}
+            continue
+        chunk.append((line, user))
+        if len(chunk) < chunk_size:
+            continue
+        async for report in _flush(conn, executor, workers, chunk, summary):
+            yield report
+        chunk = []
+    if chunk:
+        async for report in _flush(conn, executor, workers, chunk, summary):
+            yield report
+    await conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    yield summary
+
+
+async def _flush(conn, executor, workers, chunk, summary):
+    await _hash_chunk(executor, chunk, workers)
+    imported, duplicates = await _load_chunk(conn, chunk)
+    summary["imported"] += imported
+    summary["duplicates"] += len(duplicates)
+    for report in duplicates:
+        yield report
+
+
+async def _main(args):
+    async with database.async_engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        with open(args.file, encoding="utf-8") as source:
+            async for report in import_users(
+                raw.driver_connection,
+                iter_file_lines(source),
+                fmt=args.format,
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+            ):
+                print(json.dumps(report), flush=True)
+    await database.async_engine.dispose()
+    await run_in_threadpool(utils.get_hashing_executor().shutdown)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+    if args.format is None:
+        args.format = "csv" if args.file.endswith(".csv") else "ndjson"
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
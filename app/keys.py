@@ -0,0 +1,165 @@
+"""
+JWT signing keyring.
+
+With a symmetric algorithm (HS256, the default) tokens are signed with
+`SECRET_KEY` and nothing is published. With an asymmetric one (RS256 or
+ES256) every `<kid>.pem` private key in `JWT_KEYS_DIR` is loaded: all of them
+are accepted for verification and published as a JWKS, and the newest key
+that has been published for at least `JWT_KEY_PUBLISH_DELAY` seconds signs
+new tokens. That delay gives resource servers time to refresh their cached
+JWKS before they meet a token with the new `kid`.
+
+Rotation:
+
+    python -m app.keys generate --dir keys --algorithm ES256
+
+then remove the previous key file once every token it signed has expired.
+"""
+import argparse
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+
+from jose import jwk
+
+SYMMETRIC_ALGORITHMS = {"HS256", "HS384", "HS512"}
+ASYMMETRIC_ALGORITHMS = {"RS256", "RS384", "RS512", "ES256", "ES384", "ES512"}
+
+
+class KeyRing:
+    def __init__(
+        self,
+        algorithm: str,
+        secret_key: str = None,
+        keys_dir: str = "keys",
+        publish_delay: float = 300,
+        reload_interval: float = 60,
+    ):
+        if algorithm not in SYMMETRIC_ALGORITHMS | ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.keys_dir = keys_dir
+        self.publish_delay = publish_delay
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._signing_kid = None
+        self._private_keys = {}
+        self._public_keys = {}
+        self._jwks = {"keys": []}
+        if self.symmetric:
+            kid = hashlib.sha256(secret_key.encode()).hexdigest()[:16]
+            self._signing_kid = kid
+            self._private_keys = {kid: secret_key}
+            self._public_keys = {kid: secret_key}
+        else:
+            self.reload()
+
+    @property
+    def symmetric(self) -> bool:
+        return self.algorithm in SYMMETRIC_ALGORITHMS
+
+    def signing_key(self):
+        self._maybe_reload()
+        kid = self._signing_kid
+        return kid, self._private_keys[kid]
+
+    def verification_key(self, kid: str = None):
+        """Key for `kid`; tokens issued without a `kid` use the signing key."""
+        self._maybe_reload()
+        if kid is None:
+            kid = self._signing_kid
+        key = self._public_keys.get(kid)
+        if key is None and not self.symmetric:
+            self._maybe_reload(force=True)
+            key = self._public_keys.get(kid)
+        return key
+
+    def jwks(self) -> dict:
+        self._maybe_reload()
+        return self._jwks
+
+    def _maybe_reload(self, force: bool = False):
+        if self.symmetric:
+            return
+        now = time.monotonic()
+        if force:
+            # unknown kids are attacker-controlled, so never rescan per request
+            if now - self._checked_at < 1:
+                return
+        elif now - self._checked_at < self.reload_interval:
+            return
+        self.reload()
+
+    def reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            files = sorted(
+                (entry.stat().st_mtime, entry.name[: -len(".pem")], entry.path)
+                for entry in os.scandir(self.keys_dir)
+                if entry.is_file() and entry.name.endswith(".pem")
+            )
+            if not files:
+                raise RuntimeError(f"No signing keys found in {self.keys_dir}")
+            fingerprint = tuple(files)
+            if fingerprint != self._fingerprint:
+                private_keys, public_keys, jwks = {}, {}, []
+                for _, kid, path in files:
+                    with open(path) as key_file:
+                        private_key = jwk.construct(key_file.read(), self.algorithm)
+                    public_key = private_key.public_key()
+                    private_keys[kid] = private_key
+                    public_keys[kid] = public_key
+                    jwks.append({**public_key.to_dict(), "kid": kid, "use": "sig"})
+                self._private_keys = private_keys
+                self._public_keys = public_keys
+                self._jwks = {"keys": jwks}
+                self._fingerprint = fingerprint
+            published_before = time.time() - self.publish_delay
+            ready = [kid for mtime, kid, _ in files if mtime <= published_before]
+            self._signing_kid = ready[-1] if ready else files[-1][1]
+
+
+def generate_private_key(algorithm: str) -> str:
+    if algorithm.startswith("RS"):
+        import rsa
+
+        _, private_key = rsa.newkeys(2048)
+        return private_key.save_pkcs1().decode()
+    if algorithm.startswith("ES"):
+        import ecdsa
+
+        curve = {"ES256": ecdsa.NIST256p, "ES384": ecdsa.NIST384p}.get(
+            algorithm, ecdsa.NIST521p
+        )
+        return ecdsa.SigningKey.generate(curve=curve).to_pem().decode()
+    raise ValueError(f"Cannot generate a private key for {algorithm}")
+
+
+def write_private_key(keys_dir: str, algorithm: str) -> str:
+    os.makedirs(keys_dir, exist_ok=True)
+    kid = f"{datetime.utcnow():%Y%m%d%H%M%S}-{os.urandom(4).hex()}"
+    path = os.path.join(keys_dir, f"{kid}.pem")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as key_file:
+        key_file.write(generate_private_key(algorithm))
+    return kid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage JWT signing keys")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="add a new signing key")
+    generate.add_argument("--dir", default="keys")
+    generate.add_argument(
+        "--algorithm", default="ES256", choices=sorted(ASYMMETRIC_ALGORITHMS)
+    )
+    args = parser.parse_args(argv)
+    print(write_private_key(args.dir, args.algorithm))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,151 @@
+import asyncio
+import time
+import uuid
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
 
+from app import (audit, config, database, emails, metrics, models, oauth2,
+                 profiling, utils)
 from app.api import router
 
-app = FastAPI()
-
 origins = ["*"]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.include_router(router.router)
-
 
-@app.get("/")
 async def root():
     return {"message": "Authentication API Service"}
+
+
+def prometheus_metrics():
+    return metrics.metrics()
+
+
+def _ping(engine):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def _async_ping(engine):
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def _warm_database(settings: config.Settings):
+    # fill the pool up to pool_size and compile the user lookup once, so
+    # the first requests neither connect nor compile
+    lookup = select(models.User).where(models.User.id == uuid.UUID(int=0))
+    if settings.database_async:
+        engine = database.get_async_engine()
+        await asyncio.gather(
+            *(_async_ping(engine) for _ in range(settings.db_pool_size))
+        )
+        async with engine.connect() as conn:
+            await conn.execute(lookup)
+        return
+    engine = database.get_engine()
+    await asyncio.gather(
+        *(run_in_threadpool(_ping, engine) for _ in range(settings.db_pool_size))
+    )
+    with engine.connect() as conn:
+        conn.execute(lookup)
+
+
+async def _check_replicas():
+    replica_set = database.get_replica_set()
+    if replica_set.engines:
+        await replica_set.check()
+
+
+async def prewarm(app: FastAPI):
+    """
+    Open the connection pool, load the signing keys, start the hashing
+    processes, compile the hot queries and build the email filter before
+    serving traffic. Timings
+    in milliseconds are kept in `app.state.prewarm`
+    """
+    settings = config.get_settings()
+    timings = {}
+
+    started = time.perf_counter()
+    await asyncio.gather(_warm_database(settings), _check_replicas())
+    timings["database_ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    oauth2.decode_access_token(
+        oauth2.create_access_token({"user_id": str(uuid.UUID(int=0))})
+    )
+    timings["tokens_ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    timings["hashing_processes"] = await utils.warm_hashing()
+    await utils.dummy_hash()
+    timings["hashing_ms"] = (time.perf_counter() - started) * 1000
+
+    if settings.email_filter:
+        started = time.perf_counter()
+        await run_in_threadpool(emails.get_email_filter().rebuild)
+        timings["email_filter_ms"] = (time.perf_counter() - started) * 1000
+
+    app.state.prewarm = timings
+
+
+async def shutdown():
+    # only what this process created: a worker that served nothing has no
+    # pools or hashing processes to close
+    if audit.get_audit_log.cache_info().currsize:
+        # before the engines go: the writer drains the queue through them
+        await run_in_threadpool(audit.get_audit_log().close)
+    if utils.get_hashing_executor.cache_info().currsize:
+        utils.get_hashing_executor().shutdown()
+    if database.get_async_engine.cache_info().currsize:
+        await database.get_async_engine().dispose()
+    if database.get_engine.cache_info().currsize:
+        database.get_engine().dispose()
+    if database.get_replica_set.cache_info().currsize:
+        for engine in database.get_replica_set().engines:
+            if isinstance(engine, AsyncEngine):
+                await engine.dispose()
+            else:
+                engine.dispose()
+
+
+def create_app() -> FastAPI:
+    """
+    Build the application. Settings are read, and engines created, on first
+    use rather than at import, so `gunicorn --preload` workers start with
+    empty pools: `uvicorn --factory app.main:create_app`
+    """
+    app = FastAPI()
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.add_middleware(database.ReadYourWritesMiddleware)
+    # inside the metrics middleware, which sets the route it profiles under
+    app.add_middleware(profiling.ProfilingMiddleware)
+    app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+
+    app.include_router(router.router)
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_api_route(
+        "/metrics", prometheus_metrics, methods=["GET"], include_in_schema=False
+    )
+
+    async def startup():
+        if config.get_settings().prewarm:
+            await prewarm(app)
+
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+    return app
+
+
+app = create_app()
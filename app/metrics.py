@@ -0,0 +1,261 @@
+"""
+Prometheus metrics, served by `GET /metrics`.
+
+- `http_request_duration_seconds` and `http_requests_in_flight` per route
+  template (never the raw path, so ids do not explode the label set)
+- `db_query_duration_seconds` per engine, whose `_count` is the query count
+- `db_pool_checkout_wait_seconds` and `db_pool_checked_out`/`db_pool_size`
+- `password_hashing_seconds` per operation, queueing for the pool included
+
+Statements slower than `SLOW_QUERY_MS` are also logged, with the shape of
+their parameters (never the values) and the route that ran them, and the
+latest are kept for `GET /stats/slow-queries`.
+
+Under gunicorn set `PROMETHEUS_MULTIPROC_DIR` to an empty directory so every
+worker writes its samples there and `/metrics` aggregates them.
+"""
+import logging
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.responses import Response
+from starlette.routing import Match
+
+from app import config
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests being served",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing SQL statements",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+QUERY_ERRORS = Counter("db_query_errors", "Failed SQL statements", ["engine"])
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Pooled connections in use",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+POOL_SIZE = Gauge(
+    "db_pool_size",
+    "Configured connection pool size",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+HASHING_DURATION = Histogram(
+    "password_hashing_seconds",
+    "bcrypt work including the wait for a hashing process",
+    ["operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+UNMATCHED_ROUTE = "unmatched"
+STATEMENT_MAX_LENGTH = 2000
+
+# route template of the request being served, set by `MetricsMiddleware`
+current_route = ContextVar("current_route", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    `QueuePool` recording how long each checkout waited for a connection,
+    labelled with the name given to `instrument_engine`
+    """
+
+    metrics_name = "default"
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_name).observe(
+                time.perf_counter() - started
+            )
+
+
+class TimedAsyncAdaptedQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    pass
+
+
+def _parameters_shape(parameters):
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class SlowQueryLog:
+    """The latest statements that took `threshold` seconds or more"""
+
+    def __init__(self, threshold: float, size: int):
+        self.threshold = threshold
+        self._recent = deque(maxlen=size)
+        self._count = 0
+
+    def record(self, engine: str, statement: str, parameters, executemany, duration):
+        if executemany:
+            shape = {
+                "rows": len(parameters),
+                "row": _parameters_shape(parameters[0]) if parameters else None,
+            }
+        else:
+            shape = _parameters_shape(parameters)
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "engine": engine,
+            "route": current_route.get(),
+            "duration_ms": duration * 1000,
+            "statement": statement[:STATEMENT_MAX_LENGTH],
+            "parameters": shape,
+        }
+        self._recent.append(entry)
+        self._count += 1
+        logger.warning(
+            "Slow query, %.1f ms on %s from %s: %s %s",
+            entry["duration_ms"],
+            engine,
+            entry["route"],
+            " ".join(entry["statement"].split()),
+            shape,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "count": self._count,
+            "recent": list(self._recent),
+        }
+
+
+@lru_cache()
+def get_slow_query_log() -> SlowQueryLog:
+    settings = config.get_settings()
+    return SlowQueryLog(
+        threshold=settings.slow_query_ms / 1000, size=settings.slow_query_log_size
+    )
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def instrument_engine(engine, name: str):
+    """
+    Time every statement run on `engine` (the `sync_engine` of an async one),
+    log the slow ones and publish its pool usage
+    """
+    slow_queries = get_slow_query_log()
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_started"].pop()
+        QUERY_DURATION.labels(name).observe(duration)
+        if 0 < slow_queries.threshold <= duration:
+            slow_queries.record(name, statement, parameters, executemany, duration)
+
+    def handle_error(context):
+        # no connection when connecting itself failed
+        if context.connection is not None:
+            stack = context.connection.info.get("query_started")
+            if stack:
+                stack.pop()
+        QUERY_ERRORS.labels(name).inc()
+
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", after_execute)
+    event.listen(engine, "handle_error", handle_error)
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics_name = name
+    if isinstance(engine.pool, QueuePool):
+        checked_out = POOL_CHECKED_OUT.labels(name)
+        event.listen(engine, "checkout", lambda *args: checked_out.inc())
+        event.listen(engine, "checkin", lambda *args: checked_out.dec())
+        POOL_SIZE.labels(name).set(engine.pool.size())
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request. Matching the route up
+    front costs one regex per route; no per-request objects are created
+    beyond the `send` wrapper.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    def _route(self, scope) -> str:
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route.path
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = self._route(scope)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        current_route.set(route)
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_DURATION.labels(method, route, status).observe(
+                time.perf_counter() - started
+            )
+            in_flight.dec()
+
+
+def metrics() -> Response:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
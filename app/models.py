@@ -1,5 +1,7 @@
-from sqlalchemy import ARRAY, Column, String
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (ARRAY, BigInteger, Column, ForeignKey, Index, Integer,
+                        String)
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 
@@ -20,6 +22,73 @@ class User(Base):
     created_at = Column(
         TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
     )
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=True, index=True)
+
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),
+        Index("ix_users_scopes", "scopes", postgresql_using="gin"),
+        Index("ix_users_email_lower", func.lower(email), unique=True),
+    )
 
     def __repr__(self):
         return f"{self.__tablename__}{self.id}"
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    id = Column(
+        UUID(as_uuid=True),
+        primary_key=True,
+        nullable=False,
+        server_default=text("gen_random_uuid()"),
+    )
+    token_hash = Column(String, nullable=False, unique=True, index=True)
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    family_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    used_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    revoked_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    jti = Column(String, primary_key=True, nullable=False)
+    user_id = Column(UUID(as_uuid=True), nullable=True)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    revoked_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+        index=True,
+    )
+
+
+class LoginAttempt(Base):
+    __tablename__ = "login_attempts"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+    key = Column(String, primary_key=True, nullable=False)
+    window_start = Column(BigInteger, nullable=False)
+    current = Column(Integer, nullable=False)
+    previous = Column(Integer, nullable=False)
+
+
+class AuditEvent(Base):
+    # no foreign keys: the trail outlives the users it mentions
+    __tablename__ = "audit_events"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    event = Column(String, nullable=False)
+    user_id = Column(UUID(as_uuid=True), nullable=True)
+    actor_id = Column(UUID(as_uuid=True), nullable=True)
+    ip = Column(String, nullable=True)
+    detail = Column(JSONB(none_as_null=True), nullable=True)
+
+    __table_args__ = (Index("ix_audit_events_user_id_id", "user_id", "id"),)
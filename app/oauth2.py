@@ -1,41 +1,149 @@
+import hashlib
+import secrets
+import time
 import uuid
-from datetime import datetime, timedelta
+from functools import lru_cache
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
-from jose import JWSError, JWTError, jwt
+from jose import JWSError, JWTError
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy import any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import config, database, models, schemas
+from app import config, database, keys, models, permissions, schemas, tokens
+from app.cache import TTLCache
+from app.revocation import Denylist
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="login",
-    scopes={"admin": "ultimate access"},
+    scopes=permissions.DESCRIPTIONS,
 )
 
-SECRET_KEY = config.settings.secret_key
-ALGORITHM = config.settings.algorithm
-ACCESS_TOKEN_EXPIRE_MINUTES = config.settings.access_token_expire_minutes
+_decode_stats = {"count": 0, "seconds": 0.0}
+
+
+@lru_cache()
+def get_keyring() -> keys.KeyRing:
+    settings = config.get_settings()
+    return keys.KeyRing(
+        algorithm=settings.algorithm,
+        secret_key=settings.secret_key,
+        keys_dir=settings.jwt_keys_dir,
+        publish_delay=settings.jwt_key_publish_delay,
+        reload_interval=settings.jwt_keys_reload_seconds,
+    )
+
+
+@lru_cache()
+def get_jwt_codec():
+    return tokens.codec(config.get_settings().jwt_backend, get_keyring())
+
+
+@lru_cache()
+def get_user_cache() -> TTLCache:
+    settings = config.get_settings()
+    return TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+
+@lru_cache()
+def get_token_cache() -> TTLCache:
+    settings = config.get_settings()
+    return TTLCache(
+        maxsize=settings.token_cache_size,
+        ttl=settings.access_token_expire_minutes * 60,
+    )
+
+
+@lru_cache()
+def get_denylist() -> Denylist:
+    settings = config.get_settings()
+    return Denylist(
+        capacity=settings.revocation_filter_capacity,
+        sync_interval=settings.revocation_sync_seconds,
+    )
+
+
+__getattr__ = config.lazy_attributes(
+    __name__,
+    {
+        "keyring": get_keyring,
+        "jwt_codec": get_jwt_codec,
+        "user_cache": get_user_cache,
+        "token_cache": get_token_cache,
+        "denylist": get_denylist,
+    },
+)
 
 
 def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    expire = int(time.time()) + config.get_settings().access_token_expire_minutes * 60
+    return get_jwt_codec().encode({**data, "exp": expire, "jti": uuid.uuid4().hex})
+
+
+def create_refresh_token():
+    """Opaque refresh token and the digest stored in place of it."""
+    token = secrets.token_urlsafe(32)
+    return token, hash_refresh_token(token)
 
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def decode_access_token(token: str) -> dict:
+    return get_jwt_codec().decode(token)
+
+
+def decode_token_data(token: str) -> schemas.TokenData:
+    """
+    Verified claims of `token`, served from `token_cache` when the same token
+    was already verified; entries expire together with the token.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    token_cache = get_token_cache()
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return token_data
+    started = time.perf_counter()
+    payload = decode_access_token(token)
+    user_id = payload.get("user_id")
+    if not user_id:
+        raise JWTError("Token has no user_id claim")
+    perms = payload.get("perms")
+    if perms is None:
+        # tokens issued with a list of scope names
+        perms = permissions.mask(payload.get("scopes", []))
+    token_data = schemas.TokenData(
+        permissions=perms,
+        id=user_id,
+        jti=payload.get("jti"),
+        exp=payload.get("exp"),
+    )
+    _decode_stats["count"] += 1
+    _decode_stats["seconds"] += time.perf_counter() - started
+    if payload.get("exp"):
+        token_cache.set(digest, token_data, ttl=payload["exp"] - time.time())
+    return token_data
+
+
+def token_cache_stats() -> dict:
+    stats = get_token_cache().stats()
+    decodes = _decode_stats["count"]
+    decode_avg = _decode_stats["seconds"] / decodes if decodes else 0.0
+    stats.update(
+        decodes=decodes,
+        decode_avg_us=decode_avg * 1e6,
+        decode_saved_ms=stats["hits"] * decode_avg * 1000,
+    )
+    return stats
 
 
 def verify_access_token(token: str, credentials_exception: HTTPException):
     try:
-        payload = jwt.decode(token, SECRET_KEY, [ALGORITHM])
-        idx: str = payload.get("user_id")
-        if not idx:
-            raise credentials_exception
-        token_data = schemas.TokenData(id=idx)
-    except JWSError:
+        token_data = decode_token_data(token)
+    except (JWSError, JWTError, ValidationError):
         raise credentials_exception
     return token_data
 
@@ -43,7 +151,7 @@ def verify_access_token(token: str, credentials_exception: HTTPException):
 async def get_current_user(
     security_scopes: SecurityScopes,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(database.get_session),
+    db: AsyncSession = Depends(database.get_read_session),
 ):
     if security_scopes.scopes:
         authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
@@ -54,35 +162,97 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": authenticate_value},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("user_id")
-        if user_id is None:
-            raise credentials_exception
-        token_scopes = payload.get("scopes", [])
-        token_data = schemas.TokenData(scopes=token_scopes, id=user_id)
-    except (JWTError, ValidationError):
+    denylist = get_denylist()
+    if denylist.needs_sync:
+        await denylist.sync(db)
+    token_data = _active_token_data(token)
+    if token_data is None:
         raise credentials_exception
-    user = _get_user(db, idx=token_data.id)
+    user = await _get_user(db, idx=token_data.id)
     if user is None:
         raise credentials_exception
-    for scope in security_scopes.scopes:
-        if scope not in token_data.scopes:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Not enough permissions",
-                headers={"WWW-Authenticate": authenticate_value},
-            )
+    required = permissions.required(tuple(security_scopes.scopes))
+    if token_data.permissions & required != required:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not enough permissions",
+            headers={"WWW-Authenticate": authenticate_value},
+        )
     return user
 
 
-def _get_user(db, idx: uuid):
-    user = db.query(models.User).filter(models.User.id == idx).first()
+def _active_token_data(token: str):
+    """Claims of `token` if it is valid and not revoked, else None"""
+    try:
+        token_data = decode_token_data(token)
+    except (JWTError, ValidationError):
+        return None
+    if token_data.jti and token_data.jti in get_denylist():
+        return None
+    return token_data
+
+
+async def introspect(db: AsyncSession, tokens: list) -> list:
+    """
+    RFC 7662 style introspection of access tokens, in order. Claims come from
+    `token_cache` (kept until each token expires) and users from
+    `user_cache`, so a repeated token costs a denylist and a cache lookup;
+    users missing from the cache are loaded with one query.
+    :return dicts `active` and, for active tokens, `sub`, `scope`, `exp`
+    """
+    denylist, user_cache = get_denylist(), get_user_cache()
+    if denylist.needs_sync:
+        await denylist.sync(db)
+    verified = [_active_token_data(token) for token in tokens]
+    users = {}
+    for token_data in verified:
+        if token_data is not None and token_data.id not in users:
+            users[token_data.id] = user_cache.get(token_data.id)
+    missing = [uuid.UUID(idx) for idx, user in users.items() if user is None]
+    if missing:
+        result = await db.execute(
+            select(models.User).where(
+                models.User.id
+                == any_(bindparam("ids", missing, type_=ARRAY(UUID(as_uuid=True))))
+            )
+        )
+        for user in result.scalars():
+            users[str(user.id)] = schemas.UserOut.from_orm(user)
+            user_cache.set(str(user.id), users[str(user.id)])
+
+    results = []
+    for token_data in verified:
+        if token_data is None or users[token_data.id] is None:
+            results.append({"active": False})
+            continue
+        results.append(
+            {
+                "active": True,
+                "sub": token_data.id,
+                "scope": " ".join(permissions.names(token_data.permissions)),
+                "exp": token_data.exp,
+            }
+        )
+    return results
+
+
+async def _get_user(db: AsyncSession, idx: uuid):
+    user_cache = get_user_cache()
+    user = user_cache.get(str(idx))
+    if user is not None:
+        return user
+    result = await db.execute(select(models.User).where(models.User.id == idx))
+    user = result.scalars().first()
 
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with id: {idx} does not exist",
         )
+    user = schemas.UserOut.from_orm(user)
+    user_cache.set(str(idx), user)
     return user
 
+
+def invalidate_user(idx: uuid):
+    get_user_cache().invalidate(str(idx))
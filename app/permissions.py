@@ -0,0 +1,110 @@
+"""
+Role and permission registry.
+
+`users.scopes` holds role and permission names. A role grants its own
+permissions plus those of every role it inherits from. Access tokens carry
+the effective permissions as one integer bitmask claim (`perms`), so a scope
+check is a single AND no matter how large the catalog grows.
+
+The bit of each permission is its position in `PERMISSIONS`: tokens in
+flight depend on it, so only ever append to that tuple.
+"""
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+PERMISSIONS: Tuple[str, ...] = (
+    "admin",
+    "users:read",
+    "users:write",
+    "stats:read",
+    "tokens:introspect",
+)
+
+DESCRIPTIONS: Dict[str, str] = {
+    "admin": "ultimate access",
+    "users:read": "read user accounts",
+    "users:write": "change user accounts",
+    "stats:read": "read service statistics",
+    "tokens:introspect": "check access tokens for other services",
+}
+
+
+class Role(NamedTuple):
+    permissions: Tuple[str, ...]
+    inherits: Tuple[str, ...] = ()
+
+
+ROLES: Dict[str, Role] = {
+    # account created, email not confirmed yet
+    "registered": Role(permissions=("users:read",)),
+    # email confirmed
+    "confirmed": Role(permissions=("users:write",), inherits=("registered",)),
+    # account has admin permission
+    "admin": Role(
+        permissions=("admin", "stats:read", "tokens:introspect"),
+        inherits=("confirmed",),
+    ),
+}
+
+BITS: Dict[str, int] = {name: 1 << bit for bit, name in enumerate(PERMISSIONS)}
+
+
+def _role_mask(role: str, seen: tuple = ()) -> int:
+    if role in seen:
+        raise ValueError(f"Role inheritance cycle through {role}")
+    definition = ROLES[role]
+    mask = 0
+    for permission in definition.permissions:
+        mask |= BITS[permission]
+    for parent in definition.inherits:
+        mask |= _role_mask(parent, seen + (role,))
+    return mask
+
+
+ROLE_MASKS: Dict[str, int] = {role: _role_mask(role) for role in ROLES}
+
+
+def is_known(name: str) -> bool:
+    return name in ROLE_MASKS or name in BITS
+
+
+def mask(names: Iterable[str]) -> int:
+    """Effective permissions of a user's scopes; unknown names grant nothing"""
+    result = 0
+    for name in names or ():
+        result |= ROLE_MASKS.get(name, 0) | BITS.get(name, 0)
+    return result
+
+
+@lru_cache(maxsize=None)
+def required(names: Tuple[str, ...]) -> int:
+    """
+    Mask a route requires, for the scopes it declares. A name that is both
+    a permission and a role (`admin`) stands for the permission here
+    """
+    result = 0
+    for name in names:
+        if name in BITS:
+            result |= BITS[name]
+        elif name in ROLE_MASKS:
+            result |= ROLE_MASKS[name]
+        else:
+            raise ValueError(f"Unknown permission: {name}")
+    return result
+
+
+def names(permissions: int) -> List[str]:
+    """Permission names set in a mask"""
+    return [name for name, bit in BITS.items() if permissions & bit]
+
+
+@lru_cache(maxsize=None)
+def granting(permission: str) -> Tuple[str, ...]:
+    """
+    Every scope name that grants `permission`: itself and the roles that
+    include it. `users.scopes && granting(...)` finds its holders through
+    the GIN index on the column.
+    """
+    bit = BITS[permission]
+    roles = [role for role, role_mask in ROLE_MASKS.items() if role_mask & bit]
+    return tuple(dict.fromkeys([permission, *roles]))
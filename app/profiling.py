@@ -0,0 +1,175 @@
+"""
+Profiles of single requests, to see where the time of a slow one went.
+
+`ProfilingMiddleware` runs cProfile over a request picked by
+`PROFILING_SAMPLE_RATE` or by an admin sending the `X-Profile` header, and
+spools the stats to `PROFILING_DIR` (open them with `python -m pstats` or
+snakeviz). cProfile follows the event loop thread, so a profile also holds
+whatever other requests ran meanwhile, and a worker profiles one request at
+a time.
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from starlette.concurrency import run_in_threadpool
+
+from app import config, metrics, oauth2, permissions
+
+PROFILE_HEADER = b"x-profile"
+
+
+def _bearer_token(headers: list):
+    for name, value in headers:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                return token
+    return None
+
+
+def _is_admin(headers: list) -> bool:
+    """The request carries a valid, unrevoked token with the `admin` scope"""
+    token = _bearer_token(headers)
+    if not token:
+        return False
+    token_data = oauth2._active_token_data(token)
+    required = permissions.required(("admin",))
+    return token_data is not None and token_data.permissions & required == required
+
+
+class Profiler:
+    """
+    Profiles of this worker and the spool they are written to. A profile is
+    kept when the request took at least `min_duration` seconds; the spool
+    keeps the newest `max_files`.
+    """
+
+    def __init__(
+        self, directory: str, sample_rate: float, min_duration: float, max_files: int
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.min_duration = min_duration
+        self.max_files = max_files
+        self._active = False
+        self._profiled = 0
+        self._written = 0
+        self._too_fast = 0
+        self._busy = 0
+        self._last_file = None
+
+    def wanted(self, headers: list) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return any(name == PROFILE_HEADER for name, _ in headers) and _is_admin(headers)
+
+    def start(self):
+        """A running profiler, None when another profile is under way"""
+        if self._active or sys.getprofile() is not None:
+            self._busy += 1
+            return None
+        self._active = True
+        self._profiled += 1
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile: cProfile.Profile, duration: float) -> bool:
+        """Stop `profile`; True if it is slow enough to be written"""
+        profile.disable()
+        self._active = False
+        if duration < self.min_duration:
+            self._too_fast += 1
+            return False
+        return True
+
+    def write(self, profile: cProfile.Profile, method: str, route: str, duration):
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        name = (
+            f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S.%f}-{os.getpid()}-"
+            f"{method}-{slug}-{duration * 1000:.0f}ms.prof"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path)
+        self._written += 1
+        self._last_file = path
+        self._prune()
+        return path
+
+    def _prune(self):
+        # names start with the time, so they sort oldest first
+        files = sorted(
+            name for name in os.listdir(self.directory) if name.endswith(".prof")
+        )
+        for name in files[: max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # pruned by another worker
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "directory": os.path.abspath(self.directory),
+            "sample_rate": self.sample_rate,
+            "profiled": self._profiled,
+            "written": self._written,
+            "too_fast": self._too_fast,
+            "busy": self._busy,
+            "last_file": self._last_file,
+        }
+
+
+@lru_cache()
+def get_profiler() -> Profiler:
+    settings = config.get_settings()
+    return Profiler(
+        directory=settings.profiling_dir,
+        sample_rate=settings.profiling_sample_rate,
+        min_duration=settings.profiling_min_ms / 1000,
+        max_files=settings.profiling_max_files,
+    )
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling requests when `PROFILING` is on. Placed
+    inside `MetricsMiddleware`, which has matched the route by then.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.get_settings().profiling:
+            await self.app(scope, receive, send)
+            return
+        profiler = get_profiler()
+        profile = profiler.start() if profiler.wanted(scope["headers"]) else None
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            duration = time.perf_counter() - started
+            if profiler.stop(profile, duration):
+                # the response is out, only this task waits for the disk
+                await run_in_threadpool(
+                    profiler.write,
+                    profile,
+                    scope["method"],
+                    metrics.current_route.get(),
+                    duration,
+                )
+
+
+__getattr__ = config.lazy_attributes(__name__, {"profiler": get_profiler})
@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+
+# seconds a replica is behind the primary; 0 when it has replayed everything
+# it received (an idle primary writes nothing to replay) or is no standby
+LAG_QUERY = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery()"
+    " OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE("
+    "extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)"
+    " END"
+)
+
+
+def _sync_lag(engine) -> float:
+    with engine.connect() as conn:
+        return float(conn.execute(LAG_QUERY).scalar())
+
+
+async def _lag(engine) -> float:
+    if isinstance(engine, AsyncEngine):
+        async with engine.connect() as conn:
+            return float((await conn.execute(LAG_QUERY)).scalar())
+    return await run_in_threadpool(_sync_lag, engine)
+
+
+class ReplicaSet:
+    """
+    Read replicas of this worker, handed out round robin among the healthy
+    ones.
+
+    A replica is healthy when it answered the last check within `timeout`
+    seconds and lagged at most `max_lag` seconds. Checks run at most every
+    `check_interval` seconds, from the request that finds them stale; a
+    replica whose connection breaks in between is taken out until the next
+    check.
+    """
+
+    def __init__(
+        self, engines: list, check_interval: float, max_lag: float, timeout: float
+    ):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.timeout = timeout
+        self._lags = [None] * len(engines)
+        self._healthy = [False] * len(engines)
+        self._counter = itertools.count()
+        self._checked_at = None
+        self._checking = False
+
+    @property
+    def needs_check(self) -> bool:
+        if not self.engines or self._checking:
+            return False
+        return (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at >= self.check_interval
+        )
+
+    async def check(self):
+        self._checking = True
+        try:
+            started = time.monotonic()
+            results = await asyncio.gather(
+                *(
+                    asyncio.wait_for(_lag(engine), self.timeout)
+                    for engine in self.engines
+                ),
+                return_exceptions=True,
+            )
+            for index, lag in enumerate(results):
+                if isinstance(lag, Exception):
+                    lag = None
+                self._lags[index] = lag
+                self._healthy[index] = lag is not None and lag <= self.max_lag
+            self._checked_at = started
+        finally:
+            self._checking = False
+
+    async def choose(self):
+        """Next healthy replica engine, None to use the primary"""
+        if self.needs_check:
+            await self.check()
+        for _ in range(len(self.engines)):
+            index = next(self._counter) % len(self.engines)
+            if self._healthy[index]:
+                return self.engines[index]
+        return None
+
+    def mark_down(self, engine):
+        for index, candidate in enumerate(self.engines):
+            if candidate is engine or getattr(candidate, "sync_engine", None) is engine:
+                self._healthy[index] = False
+
+    def stats(self) -> list:
+        return [
+            {
+                "url": engine.url.render_as_string(hide_password=True),
+                "healthy": healthy,
+                "lag_seconds": lag,
+            }
+            for engine, healthy, lag in zip(self.engines, self._healthy, self._lags)
+        ]
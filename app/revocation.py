@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.bloom import BloomFilter
+
+# seconds re-read on every sync, so revocations committed slightly out of
+# order are still picked up
+SYNC_OVERLAP = 30
+
+
+class Denylist:
+    """
+    Revoked access token ids (jti) of this worker, mirrored from
+    `revoked_tokens`.
+
+    Lookups hit a Bloom filter first, so the common not-revoked case never
+    touches the exact set. Revocations made by other workers arrive with the
+    next `sync`, at most `sync_interval` seconds later.
+    """
+
+    def __init__(self, capacity: int, sync_interval: float):
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self._filter = BloomFilter(capacity)
+        self._revoked = {}
+        self._watermark = None
+        self._synced_at = None
+        self._syncing = False
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._filter and jti in self._revoked
+
+    def add(self, jti: str, expires_at: datetime):
+        if jti not in self._revoked:
+            self._filter.add(jti)
+        self._revoked[jti] = expires_at
+
+    @property
+    def needs_sync(self) -> bool:
+        if self._syncing:
+            return False
+        return (
+            self._synced_at is None
+            or time.monotonic() - self._synced_at >= self.sync_interval
+        )
+
+    async def sync(self, db: AsyncSession):
+        self._syncing = True
+        try:
+            started = time.monotonic()
+            revoked = models.RevokedToken.__table__
+            query = select(revoked.c.jti, revoked.c.expires_at)
+            if self._synced_at is None:
+                query = query.where(revoked.c.expires_at > func.now())
+            else:
+                window = started - self._synced_at + SYNC_OVERLAP
+                query = query.where(
+                    revoked.c.revoked_at > func.now() - timedelta(seconds=window)
+                )
+            result = await db.execute(query)
+            for jti, expires_at in result:
+                self.add(jti, expires_at)
+            self._prune(datetime.now(timezone.utc))
+            self._synced_at = started
+        finally:
+            self._syncing = False
+
+    def _prune(self, now: datetime):
+        """Forget expired tokens and rebuild the filter once it is mostly stale."""
+        for jti in [
+            jti for jti, expires_at in self._revoked.items() if expires_at <= now
+        ]:
+            del self._revoked[jti]
+        live = len(self._revoked)
+        if (
+            self._filter.count > max(2 * live, self.capacity // 2)
+            or live > self.capacity
+        ):
+            self._filter = BloomFilter(max(self.capacity, 2 * live))
+            for jti in self._revoked:
+                self._filter.add(jti)
+
+    def stats(self) -> dict:
+        return {
+            "revoked": len(self._revoked),
+            "filter_entries": self._filter.count,
+            "filter_bits": self._filter.size,
+            "synced_seconds_ago": (
+                None if self._synced_at is None else time.monotonic() - self._synced_at
+            ),
+        }
@@ -1,13 +1,20 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from pydantic import UUID4, BaseModel, EmailStr
+from pydantic import UUID4, BaseModel, EmailStr, validator
+
+
+def _lower(cls, value: str) -> str:
+    # emails are stored lowercased, see `app.emails`
+    return value.lower()
 
 
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
 
+    _normalize_email = validator("email", allow_reuse=True)(_lower)
+
 
 class UserOut(BaseModel):
     id: UUID4
@@ -19,6 +26,47 @@ class UserOut(BaseModel):
         orm_mode = True
 
 
+class UserBatchGet(BaseModel):
+    ids: List[UUID4]
+
+
+class UserBatchOut(BaseModel):
+    users: Dict[str, UserOut]
+    missing: List[UUID4]
+
+
+class UserPage(BaseModel):
+    items: List[UserOut]
+    next_cursor: Optional[str]
+
+
+class AuditEventOut(BaseModel):
+    id: int
+    created_at: datetime
+    event: str
+    user_id: Optional[UUID4]
+    actor_id: Optional[UUID4]
+    ip: Optional[str]
+    detail: Optional[Dict]
+
+    class Config:
+        orm_mode = True
+
+
+class AuditPage(BaseModel):
+    items: List[AuditEventOut]
+    next_before: Optional[int]
+
+
+class UserImport(BaseModel):
+    email: EmailStr
+    password: Optional[str]
+    password_hash: Optional[str]
+    scopes: Optional[List[str]]
+
+    _normalize_email = validator("email", allow_reuse=True)(_lower)
+
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
@@ -32,8 +80,34 @@ class UserPermission(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str]
+
+
+class Introspect(BaseModel):
+    tokens: List[str]
+
+
+class TokenIntrospection(BaseModel):
+    active: bool
+    sub: Optional[str]
+    scope: Optional[str]
+    exp: Optional[int]
+
+
+class IntrospectOut(BaseModel):
+    results: List[TokenIntrospection]
+
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+
+class Logout(BaseModel):
+    refresh_token: Optional[str]
 
 
 class TokenData(BaseModel):
     id: Optional[str] = None
-    scopes: List[str] = []
+    permissions: int = 0
+    jti: Optional[str] = None
+    exp: Optional[int] = None
@@ -0,0 +1,180 @@
+import importlib
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from app import database
+
+
+def _estimate(window_start, current, previous, now, window):
+    """
+    Sliding-window count: the previous fixed window is weighted by how much
+    of it still overlaps the last `window` seconds.
+    """
+    weight = max(window - (now - window_start), 0) / window
+    return previous * weight + current
+
+
+def _retry_after(window_start, current, previous, now, window, limit) -> float:
+    if current >= limit:
+        return window_start + window - now
+    # the previous window's share has to decay below what is left of the limit
+    overlap = window * (limit - current) / previous
+    return max(window_start + window - overlap - now, 0) or 1
+
+
+class MemoryBackend:
+    """
+    Counters of this worker only, kept in an LRU of at most `max_keys` keys.
+    Keys idle for two windows hold no count and are dropped as they surface.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time.time()
+        window_start = math.floor(now / window) * window
+        with self._lock:
+            started, current, previous = self._counters.pop(key, (window_start, 0, 0))
+            if started != window_start:
+                previous = current if started == window_start - window else 0
+                current = 0
+            current += 1
+            self._counters[key] = (window_start, current, previous)
+            self._expire(window_start - window)
+        if _estimate(window_start, current - 1, previous, now, window) < limit:
+            return 0
+        return _retry_after(window_start, current - 1, previous, now, window, limit)
+
+    def _expire(self, oldest_window: float):
+        while self._counters:
+            key, (started, _, _) = next(iter(self._counters.items()))
+            if started >= oldest_window and len(self._counters) <= self.max_keys:
+                return
+            del self._counters[key]
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class DatabaseBackend:
+    """
+    Counters shared by every worker through the unlogged `login_attempts`
+    table, one upsert per hit.
+    """
+
+    HIT = text(
+        """
+        INSERT INTO login_attempts AS a (key, window_start, current, previous)
+        VALUES (:key, :window_start, 1, 0)
+        ON CONFLICT (key) DO UPDATE SET
+            previous = CASE
+                WHEN a.window_start = :window_start THEN a.previous
+                WHEN a.window_start = :previous_window THEN a.current
+                ELSE 0
+            END,
+            current = CASE
+                WHEN a.window_start = :window_start THEN a.current + 1
+                ELSE 1
+            END,
+            window_start = :window_start
+        RETURNING current, previous
+        """
+    )
+    EXPIRE = text("DELETE FROM login_attempts WHERE window_start < :oldest_window")
+
+    def __init__(self, engine=None, expire_probability: float = 0.001):
+        self.engine = engine or database.async_engine
+        self.expire_probability = expire_probability
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time.time()
+        window = int(window)
+        window_start = math.floor(now / window) * window
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                self.HIT,
+                {
+                    "key": key,
+                    "window_start": window_start,
+                    "previous_window": window_start - window,
+                },
+            )
+            current, previous = result.first()
+            if random.random() < self.expire_probability:
+                await conn.execute(
+                    self.EXPIRE, {"oldest_window": window_start - window}
+                )
+        if _estimate(window_start, current - 1, previous, now, window) < limit:
+            return 0
+        return _retry_after(window_start, current - 1, previous, now, window, limit)
+
+    def __len__(self):
+        return 0
+
+
+def load_backend(name: str, max_keys: int):
+    """`memory`, `database`, or the `module:Class` path of a custom backend."""
+    if name == "memory":
+        return MemoryBackend(max_keys=max_keys)
+    if name == "database":
+        return DatabaseBackend()
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)()
+
+
+class LoginThrottle:
+    """
+    Per-email and per-client-IP login rate limits. A limit of 0 turns that
+    key off. Every attempt counts, rejected ones included, so a client that
+    keeps hammering stays locked out.
+    """
+
+    def __init__(self, backend, per_email: int, per_ip: int, window: float):
+        self.backend = backend
+        self.per_email = per_email
+        self.per_ip = per_ip
+        self.window = window
+        self.allowed = 0
+        self.rejected_email = 0
+        self.rejected_ip = 0
+
+    async def check(self, email: str, ip: str) -> float:
+        """Seconds until the client may retry, 0 when the attempt is allowed."""
+        if self.per_ip and ip:
+            retry_after = await self.backend.hit(f"ip:{ip}", self.per_ip, self.window)
+            if retry_after:
+                self.rejected_ip += 1
+                return retry_after
+        if self.per_email and email:
+            retry_after = await self.backend.hit(
+                f"email:{email.lower()}", self.per_email, self.window
+            )
+            if retry_after:
+                self.rejected_email += 1
+                return retry_after
+        self.allowed += 1
+        return 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "per_email": self.per_email,
+            "per_ip": self.per_ip,
+            "window": self.window,
+            "allowed": self.allowed,
+            "rejected_email": self.rejected_email,
+            "rejected_ip": self.rejected_ip,
+            "tracked_keys": len(self.backend),
+        }
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(int(math.ceil(seconds)), 1))
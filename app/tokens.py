@@ -0,0 +1,162 @@
+"""
+JWT codecs, chosen with `JWT_BACKEND`. Both sign and verify with the
+keyring's keys and accept each other's tokens.
+
+- `jose`: python-jose, which builds and parses the header, resolves the
+  key and validates every registered claim on each call
+- `native`: the header segment of each `kid` is encoded once, HS* keys are
+  prepared HMAC objects copied per token and claims go through orjson.
+  RS*/ES* tokens are signed with the keyring's parsed key objects. Checks
+  `exp`, `nbf` and that no `aud` is set, the claims this service issues
+  or must refuse
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+
+import orjson
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+
+from app import keys
+
+HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class JoseCodec:
+    def __init__(self, keyring: keys.KeyRing):
+        self.keyring = keyring
+
+    def encode(self, claims: dict) -> str:
+        kid, key = self.keyring.signing_key()
+        return jwt.encode(
+            claims, key, algorithm=self.keyring.algorithm, headers={"kid": kid}
+        )
+
+    def decode(self, token: str) -> dict:
+        key = self.keyring.verification_key(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=[self.keyring.algorithm])
+
+
+class NativeCodec:
+    def __init__(self, keyring: keys.KeyRing):
+        self.keyring = keyring
+        self.algorithm = keyring.algorithm
+        self._headers = {}
+        # header segments of verified tokens, so known ones skip parsing
+        self._kids = {}
+        self._hmacs = {}
+
+    def _header(self, kid: str) -> bytes:
+        segment = self._headers.get(kid)
+        if segment is None:
+            header = {"alg": self.algorithm, "kid": kid, "typ": "JWT"}
+            segment = _b64encode(
+                json.dumps(header, separators=(",", ":"), sort_keys=True).encode()
+            )
+            self._headers[kid] = segment
+        return segment
+
+    def _hmac(self, key: str):
+        prepared = self._hmacs.get(key)
+        if prepared is None:
+            prepared = hmac.new(key.encode(), digestmod=HMAC_DIGESTS[self.algorithm])
+            self._hmacs[key] = prepared
+        return prepared.copy()
+
+    def _sign(self, key, signing_input: bytes) -> bytes:
+        if self.keyring.symmetric:
+            mac = self._hmac(key)
+            mac.update(signing_input)
+            return mac.digest()
+        return key.sign(signing_input)
+
+    def _verify(self, key, signing_input: bytes, signature: bytes) -> bool:
+        if self.keyring.symmetric:
+            return hmac.compare_digest(self._sign(key, signing_input), signature)
+        return key.verify(signing_input, signature)
+
+    def encode(self, claims: dict) -> str:
+        kid, key = self.keyring.signing_key()
+        signing_input = b".".join((self._header(kid), _b64encode(orjson.dumps(claims))))
+        signature = _b64encode(self._sign(key, signing_input))
+        return b".".join((signing_input, signature)).decode()
+
+    def _header_kid(self, segment: str):
+        try:
+            header = orjson.loads(_b64decode(segment))
+        except (binascii.Error, ValueError):
+            raise JWTError("Invalid header")
+        if not isinstance(header, dict) or header.get("alg") != self.algorithm:
+            raise JWTError("The specified alg value is not allowed")
+        kid = header.get("kid")
+        if kid is not None and not isinstance(kid, str):
+            raise JWTError("Invalid kid")
+        return kid
+
+    def decode(self, token: str) -> dict:
+        try:
+            header, payload, signature = token.split(".")
+        except ValueError:
+            raise JWTError("Not enough segments")
+        known = header in self._kids
+        kid = self._kids[header] if known else self._header_kid(header)
+        key = self.keyring.verification_key(kid)
+        if key is None:
+            raise JWTError("Unknown signing key")
+        try:
+            signature = _b64decode(signature)
+        except (binascii.Error, ValueError):
+            raise JWTError("Invalid signature padding")
+        signing_input = token[: len(header) + len(payload) + 1].encode()
+        if not self._verify(key, signing_input, signature):
+            raise JWTError("Signature verification failed.")
+        if not known:
+            self._kids[header] = kid
+        try:
+            claims = orjson.loads(_b64decode(payload))
+        except (binascii.Error, ValueError):
+            raise JWTError("Invalid payload")
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload string: must be a json object")
+        self._validate(claims)
+        return claims
+
+    def _validate(self, claims: dict):
+        now = int(time.time())
+        try:
+            if "exp" in claims and int(claims["exp"]) < now:
+                raise ExpiredSignatureError("Signature has expired.")
+            if "nbf" in claims and int(claims["nbf"]) > now:
+                raise JWTClaimsError("The token is not yet valid (nbf)")
+        except (TypeError, ValueError):
+            raise JWTClaimsError("Time claims (exp, nbf) must be integers.")
+        if "aud" in claims:
+            raise JWTClaimsError("Invalid audience")
+
+
+CODECS = {"jose": JoseCodec, "native": NativeCodec}
+
+
+def codec(backend: str, keyring: keys.KeyRing):
+    try:
+        return CODECS[backend](keyring)
+    except KeyError:
+        raise ValueError(f"Unknown JWT backend: {backend}") from None
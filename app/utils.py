@@ -1,11 +1,133 @@
+import asyncio
+import os
+import secrets
+import time
+from functools import lru_cache
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app import config, metrics
+from app.hashing import HashingExecutor, HashingQueueFull
+
+
+@lru_cache()
+def get_pwd_context() -> CryptContext:
+    # hashes of any other cost are rehashed at the next successful login, so
+    # changing BCRYPT_ROUNDS retunes stored passwords without resets
+    rounds = config.get_settings().bcrypt_rounds
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+@lru_cache()
+def get_hashing_executor() -> HashingExecutor:
+    settings = config.get_settings()
+    return HashingExecutor(
+        max_workers=settings.hash_pool_size, queue_size=settings.hash_queue_size
+    )
+
+
+def _reset_hashing_after_fork():
+    if get_hashing_executor.cache_info().currsize:
+        get_hashing_executor().after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_hashing_after_fork)
+
+__getattr__ = config.lazy_attributes(
+    __name__,
+    {"pwd_context": get_pwd_context, "hashing_executor": get_hashing_executor},
+)
+
+
+def _hash(password: str):
+    return get_pwd_context().hash(password)
+
+
+def _hash_many(passwords: list):
+    return [get_pwd_context().hash(password) for password in passwords]
+
+
+def _verify(plain_password, hashed_password):
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+def _verify_and_update(plain_password, hashed_password):
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
+
+
+def _load_backend():
+    get_pwd_context().handler().get_backend()
+    return os.getpid()
+
+
+async def warm_hashing() -> int:
+    """
+    Start every hashing process and load bcrypt in it, so the first logins
+    after a deploy do not pay for it
+    :return number of processes that answered
+    """
+    executor = get_hashing_executor()
+    pids = await asyncio.gather(
+        *(executor.run(_load_backend) for _ in range(executor.max_workers))
+    )
+    return len(set(pids))
+
+
+async def _run_hashing(func, *args):
+    started = time.perf_counter()
+    try:
+        result = await get_hashing_executor().run(func, *args)
+        metrics.HASHING_DURATION.labels(func.__name__.lstrip("_")).observe(
+            time.perf_counter() - started
+        )
+        return result
+    except HashingQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def hash_pass(password: str):
+    return await _run_hashing(_hash, password)
+
+
+async def verify(plain_password, hashed_password):
+    return await _run_hashing(_verify, plain_password, hashed_password)
+
+
+async def verify_and_update(plain_password, hashed_password):
+    """
+    Verify a password and rehash it when the stored hash is not at the
+    configured cost
+    :return (verified, new hash or None)
+    """
+    return await _run_hashing(_verify_and_update, plain_password, hashed_password)
+
+
+_dummy_hash = None
 
 
-def hash_pass(password: str):
-    return pwd_context.hash(password)
+async def dummy_hash() -> str:
+    """Hash at the configured cost that no password matches, made once"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_pass(secrets.token_urlsafe(32))
+    return _dummy_hash
 
 
-def verify(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_dummy(plain_password) -> bool:
+    """
+    The work of `verify` for an account that does not exist, so the
+    response time does not tell whether it does
+    """
+    await verify(plain_password, await dummy_hash())
+    return False
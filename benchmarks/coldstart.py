@@ -0,0 +1,90 @@
+"""
+Cold start of a worker process: how long until it serves its first request,
+and how slow that request is, with and without prewarming:
+
+    python -m benchmarks.coldstart --runs 10 --output results/coldstart.json
+    python -m benchmarks.coldstart --runs 10 --no-prewarm \
+        --output results/coldstart-lazy.json
+
+Every run starts a fresh interpreter, which times
+
+- `import`: importing `app.main`, the module level app included
+- `startup`: the startup handlers, prewarming among them
+- `first_request` and `warm_request`: `GET /users/{idx}` of an unknown id,
+  a pooled connection and a compiled query once warm
+
+and the parent adds `process`, the wall clock time of the whole child.
+Needs the database of `.env`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.report import print_results, summarize, write_results
+
+PHASES = ("import", "startup", "first_request", "warm_request")
+
+
+def child() -> dict:
+    """Seconds per phase, measured in this (fresh) process"""
+    timings = {}
+    started = time.perf_counter()
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    timings["import"] = time.perf_counter() - started
+
+    path = "/users/00000000-0000-0000-0000-000000000000"
+    started = time.perf_counter()
+    with TestClient(app) as client:
+        timings["startup"] = time.perf_counter() - started
+        for phase in ("first_request", "warm_request"):
+            started = time.perf_counter()
+            client.get(path)
+            timings[phase] = time.perf_counter() - started
+    return timings
+
+
+def run(prewarm: bool) -> dict:
+    env = {**os.environ, "PREWARM": "true" if prewarm else "false"}
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.coldstart", "--child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(completed.stdout.splitlines()[-1])
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-prewarm", action="store_true")
+    parser.add_argument("--output", default="results/coldstart.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child()))
+        return
+
+    runs = [run(not args.no_prewarm) for _ in range(args.runs)]
+    results = {}
+    for phase in PHASES + ("process",):
+        latencies = [timings[phase] for timings in runs]
+        results[phase] = summarize(latencies, sum(latencies))
+    print_results(results)
+    options = {key: value for key, value in vars(args).items() if key != "child"}
+    write_results(args.output, "coldstart", options, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare two benchmark result files and flag regressions:
+
+    python -m benchmarks.compare results/base.json results/new.json
+
+A benchmark regresses when a latency percentile grows, or its throughput
+drops, by more than `--threshold` (10% by default). Latency changes smaller
+than `--min-delta-ms` are treated as noise. Exits with status 1 when
+anything regressed, so it can gate CI.
+"""
+import argparse
+import sys
+
+from benchmarks.report import load_results
+
+# metric -> True when higher values are better
+METRICS = {
+    "throughput": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+}
+
+
+def compare(base: dict, new: dict, threshold: float, min_delta_ms: float = 0) -> list:
+    """
+    :param base: results of the baseline run, benchmark name -> summary
+    :param new: results of the run under test
+    :param threshold: allowed relative change, 0.1 for 10%
+    :param min_delta_ms: smallest latency change that can be a regression
+    :return rows of (benchmark, metric, base, new, change, regressed)
+    """
+    rows = []
+    for name in base.keys() & new.keys():
+        for metric, higher_is_better in METRICS.items():
+            if metric not in base[name] or metric not in new[name]:
+                continue
+            before, after = base[name][metric], new[name][metric]
+            change = (after - before) / before if before else 0.0
+            if higher_is_better:
+                regressed = -change > threshold
+            else:
+                regressed = change > threshold and after - before >= min_delta_ms
+            rows.append((name, metric, before, after, change, regressed))
+    return sorted(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--min-delta-ms", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    base, new = load_results(args.base), load_results(args.new)
+    if base["kind"] != new["kind"]:
+        parser.error(f"cannot compare {base['kind']} with {new['kind']} results")
+    rows = compare(base["results"], new["results"], args.threshold, args.min_delta_ms)
+    for name, metric, before, after, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(
+            f"{name:<24} {metric:<11} {before:>12.3f} {after:>12.3f}"
+            f" {change:>+8.1%} {flag}"
+        )
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+HTTP load test of a running server.
+
+Drives `/login`, `POST /users`, `GET /users/{idx}` and the admin scoped
+`/test-admin-access` with a pool of client threads and records throughput
+and latency percentiles per route:
+
+    uvicorn app.main:app --workers 4
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 32 \
+        --requests 2000 --output results/load.json
+
+The users it creates have random `bench-...@example.com` emails, so runs
+never collide. Scopes cannot be self-granted, so `admin_access` logs in with
+`--admin-email`/`--admin-password` when given, and otherwise signs an admin
+token for a fresh user with the local settings (the server must share
+them). Start the server with LOGIN_RATE_PER_EMAIL=0 and
+LOGIN_RATE_PER_IP=0, otherwise the login throttle answers most of the
+`login` requests with 429 (reported as errors).
+"""
+import argparse
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.report import print_results, summarize, write_results
+
+PASSWORD = "bench-password"
+
+
+class Client:
+    """One keep-alive HTTP session per thread"""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        return self.session.request(
+            method, self.url + path, timeout=self.timeout, **kwargs
+        )
+
+
+def _email() -> str:
+    return f"bench-{uuid.uuid4().hex}@example.com"
+
+
+def create_user(client: Client) -> dict:
+    response = client.request(
+        "POST", "/users", json={"email": _email(), "password": PASSWORD}
+    )
+    response.raise_for_status()
+    return {**response.json(), "password": PASSWORD}
+
+
+def login(client: Client, user: dict) -> requests.Response:
+    return client.request(
+        "POST", "/login", data={"username": user["email"], "password": PASSWORD}
+    )
+
+
+def admin_token(client: Client, email: str = None, password: str = None) -> str:
+    if email:
+        response = client.request(
+            "POST", "/login", data={"username": email, "password": password}
+        )
+        response.raise_for_status()
+        return response.json()["access_token"]
+    from app import oauth2
+
+    admin = create_user(client)
+    return oauth2.create_access_token({"user_id": admin["id"], "scopes": ["admin"]})
+
+
+def scenarios(client: Client, admin_email: str = None, admin_password: str = None):
+    """Scenario name -> callable(index) returning the response"""
+    user = create_user(client)
+    token = admin_token(client, admin_email, admin_password)
+    headers = {"Authorization": f"Bearer {token}"}
+    return {
+        "login": lambda index: login(client, user),
+        "create_user": lambda index: client.request(
+            "POST", "/users", json={"email": _email(), "password": PASSWORD}
+        ),
+        "get_user": lambda index: client.request("GET", f"/users/{user['id']}"),
+        "admin_access": lambda index: client.request(
+            "GET", "/test-admin-access", headers=headers
+        ),
+    }
+
+
+def run_scenario(call, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(index):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = call(index).ok
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(total)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=["login", "create_user", "get_user", "admin_access"],
+        help="repeat to run several; all of them by default",
+    )
+    parser.add_argument("--admin-email")
+    parser.add_argument("--admin-password")
+    parser.add_argument("--output", default="results/load.json")
+    args = parser.parse_args(argv)
+
+    client = Client(args.url, args.timeout)
+    available = scenarios(client, args.admin_email, args.admin_password)
+    results = {}
+    for name in args.scenario or available:
+        run_scenario(available[name], args.warmup, args.concurrency)
+        results[name] = run_scenario(available[name], args.requests, args.concurrency)
+    print_results(results)
+    options = {
+        key: value for key, value in vars(args).items() if key != "admin_password"
+    }
+    write_results(args.output, "load", options, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+In-process micro-benchmarks of the per-request auth work, no server or
+database needed (only the settings in `.env`):
+
+    python -m benchmarks.micro --output results/micro.json
+
+- `create_access_token`: sign a token with the `JWT_BACKEND` codec
+- `decode_access_token`: verify a signature and decode the claims
+- `jwt_sign_<backend>`, `jwt_verify_<backend>`: the same for every codec in
+  `app.tokens`, on the configured keyring; one thread, so `throughput` is
+  operations per second on one core
+- `decode_token_data`: the same through the verified token cache (hits)
+- `verify_password`: one bcrypt verify at the configured cost, in this
+  process rather than the hashing pool
+"""
+import argparse
+import time
+
+from app import oauth2, tokens, utils
+from benchmarks.report import print_results, summarize, write_results
+
+
+def measure(func, iterations: int) -> dict:
+    for _ in range(max(iterations // 100, 1)):
+        func()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def benchmarks(iterations: int, verify_iterations: int) -> dict:
+    """Benchmark name -> (callable, iterations)"""
+    claims = {"user_id": "8d6ae7b8-1b46-4bd7-a3e1-6a2bd8d5e0b5", "scopes": ["admin"]}
+    token = oauth2.create_access_token(claims)
+    password_hash = utils.pwd_context.hash("bench-password")
+    codecs = {}
+    for backend in tokens.CODECS:
+        codec = tokens.codec(backend, oauth2.get_keyring())
+        signed = codec.encode({**claims, "exp": int(time.time()) + 3600})
+        codecs[f"jwt_sign_{backend}"] = (
+            lambda codec=codec: codec.encode(claims),
+            iterations,
+        )
+        codecs[f"jwt_verify_{backend}"] = (
+            lambda codec=codec, signed=signed: codec.decode(signed),
+            iterations,
+        )
+    return {
+        "create_access_token": (lambda: oauth2.create_access_token(claims), iterations),
+        "decode_access_token": (lambda: oauth2.decode_access_token(token), iterations),
+        "decode_token_data": (lambda: oauth2.decode_token_data(token), iterations),
+        "verify_password": (
+            lambda: utils._verify("bench-password", password_hash),
+            verify_iterations,
+        ),
+        **codecs,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Auth micro-benchmarks")
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--verify-iterations", type=int, default=20)
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        help="repeat to run several; all of them by default",
+    )
+    parser.add_argument("--output", default="results/micro.json")
+    args = parser.parse_args(argv)
+
+    available = benchmarks(args.iterations, args.verify_iterations)
+    unknown = set(args.benchmark or ()) - set(available)
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+    results = {}
+    for name in args.benchmark or available:
+        func, iterations = available[name]
+        results[name] = measure(func, iterations)
+    print_results(results)
+    write_results(args.output, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
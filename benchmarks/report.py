@@ -0,0 +1,85 @@
+"""
+Benchmark result files: one JSON document per run with the environment it
+ran in and a summary per benchmark.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+def summarize(latencies: list, elapsed: float, errors: int = 0) -> dict:
+    """
+    :param latencies: seconds per successful call
+    :param elapsed: wall clock seconds of the whole run
+    :param errors: failed calls, not part of the latencies
+    :return dict of counts, throughput and latency percentiles in ms
+    """
+    summary = {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if not latencies:
+        return summary
+    ms = sorted(latency * 1000 for latency in latencies)
+    cuts = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    summary.update(
+        mean_ms=statistics.fmean(ms),
+        p50_ms=cuts[49],
+        p95_ms=cuts[94],
+        p99_ms=cuts[98],
+        max_ms=ms[-1],
+    )
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, kind: str, options: dict, results: dict):
+    document = {
+        "kind": kind,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options,
+        "results": results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump(document, output, indent=2)
+        output.write("\n")
+
+
+def load_results(path: str) -> dict:
+    with open(path, encoding="utf-8") as source:
+        return json.load(source)
+
+
+def print_results(results: dict):
+    for name, summary in results.items():
+        line = f"{name:<24} n={summary['count']:<6} err={summary['errors']:<4}"
+        line += f" {summary['throughput']:>10.1f}/s"
+        if "p50_ms" in summary:
+            line += (
+                f"  p50={summary['p50_ms']:.2f}ms p95={summary['p95_ms']:.2f}ms"
+                f" p99={summary['p99_ms']:.2f}ms"
+            )
+        print(line)
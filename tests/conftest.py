@@ -1,22 +1,74 @@
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-
+from sqlalchemy.pool import NullPool
+
+from app import audit, emails
+from app.api import auth
+from app.config import settings
+from app.database import (ASYNC_DB_URI, DB_URI, DB_URI_TEST, Base,
+                          RoutingSession, ThreadedSession, get_raw_connection,
+                          get_read_session, get_session, reads_own_writes)
 from app.main import app
-from app.database import get_session, Base, DB_URI
 from app.oauth2 import create_access_token
+from app.replicas import ReplicaSet
+from app.throttle import MemoryBackend
 from tests.test_data import users
 
 SQLALCHEMY_DATABASE_URL_TEST = f'{DB_URI}_test'
 engine = create_engine(SQLALCHEMY_DATABASE_URL_TEST)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+# TestClient runs every request on a fresh event loop, so asyncpg connections
+# must not be pooled between requests.
+async_engine = create_async_engine(f'{ASYNC_DB_URI}_test', poolclass=NullPool)
+AsyncTestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False,
+    bind=async_engine, class_=AsyncSession,
+)
+TestingReadSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False,
+    bind=engine, class_=RoutingSession,
+)
+AsyncTestingReadSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False,
+    bind=async_engine, class_=AsyncSession, sync_session_class=RoutingSession,
+)
+# a second database stands in for a read replica; tests that route reads
+# to it swap in a `ReplicaSet` of these engines
+REPLICA_DATABASE = f'{settings.database_name}_test_replica'
+replica_engine = create_engine(f'{DB_URI}_test_replica')
+async_replica_engine = create_async_engine(
+    f'{ASYNC_DB_URI}_test_replica', poolclass=NullPool
+)
+replica_set = ReplicaSet([], check_interval=0, max_lag=10, timeout=5)
+
+
+@pytest.fixture(autouse=True)
+def login_throttle():
+    # every test logs in from the same client, start each with clean counters
+    auth.login_throttle.backend = MemoryBackend()
+    return auth.login_throttle
 
 
 @pytest.fixture(scope="session")
 def session():
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    server = create_engine(f'{DB_URI_TEST}postgres', isolation_level='AUTOCOMMIT')
+    with server.connect() as conn:
+        exists = conn.execute(
+            text('SELECT 1 FROM pg_database WHERE datname = :name'),
+            {'name': REPLICA_DATABASE},
+        ).scalar()
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{REPLICA_DATABASE}"'))
+    server.dispose()
+    for bind in (engine, replica_engine):
+        Base.metadata.drop_all(bind=bind)
+        Base.metadata.create_all(bind=bind)
     print('Create database')
     db = TestingSessionLocal()
     try:
@@ -27,14 +79,44 @@ def session():
 
 @pytest.fixture(scope="session")
 def client(session):
-    def override_get_db():
+    async def override_get_db():
         print('Overwrite database')
+        if settings.database_async:
+            async with AsyncTestingSessionLocal() as db:
+                yield db
+            return
+        db = ThreadedSession(TestingSessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    async def override_get_read_session(request: Request):
+        replica = None
+        if not reads_own_writes(request):
+            replica = await replica_set.choose()
+        if settings.database_async:
+            async with AsyncTestingReadSessionLocal() as db:
+                db.info['replica'] = replica.sync_engine if replica else None
+                yield db
+            return
+        db = ThreadedSession(TestingReadSessionLocal())
+        db.info['replica'] = replica
         try:
-            yield session
+            yield db
         finally:
-            session.close()
+            await db.close()
+
+    async def override_get_raw_connection():
+        async with async_engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            yield raw.driver_connection
 
+    audit.get_audit_log().engine = engine
+    emails.get_email_filter().engine = engine
     app.dependency_overrides[get_session] = override_get_db
+    app.dependency_overrides[get_read_session] = override_get_read_session
+    app.dependency_overrides[get_raw_connection] = override_get_raw_connection
     yield TestClient(app)
 
 
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+from app.main import create_app
+
+LAZY_IMPORT = """
+from app import config, database, oauth2, utils
+import app.main
+created = [
+    config.get_settings, database.get_engine, database.get_async_engine,
+    oauth2.get_keyring, utils.get_hashing_executor,
+]
+assert not any(factory.cache_info().currsize for factory in created), created
+"""
+
+
+def test_import_reads_no_settings():
+    # a fresh interpreter, this one has long created everything
+    subprocess.run([sys.executable, '-c', LAZY_IMPORT], check=True)
+
+
+def test_startup_prewarms():
+    with TestClient(create_app()) as client:
+        timings = client.app.state.prewarm
+        assert client.get('/').status_code == 200
+    assert timings['hashing_processes'] >= 1
+    assert {'database_ms', 'tokens_ms', 'hashing_ms'} <= timings.keys()
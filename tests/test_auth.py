@@ -0,0 +1,143 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app import models, oauth2, permissions
+from tests import conftest
+
+
+def _login(client, user):
+    res = client.post(
+        "/login", data={'username': user['email'], 'password': user['password']}
+    )
+    assert res.status_code == 200
+    return res.json()
+
+
+def test_refresh_token_rotation(client, test_admin):
+    tokens = _login(client, test_admin)
+    assert tokens['refresh_token']
+
+    res = client.post("/token/refresh", json={'refresh_token': tokens['refresh_token']})
+    assert res.status_code == 200
+    rotated = res.json()
+    assert rotated['access_token']
+    assert rotated['refresh_token'] != tokens['refresh_token']
+
+    res = client.post("/token/refresh", json={'refresh_token': rotated['refresh_token']})
+    assert res.status_code == 200
+
+
+def test_refresh_token_reuse_revokes_family(client, test_admin):
+    tokens = _login(client, test_admin)
+    res = client.post("/token/refresh", json={'refresh_token': tokens['refresh_token']})
+    rotated = res.json()
+
+    res = client.post("/token/refresh", json={'refresh_token': tokens['refresh_token']})
+    assert res.status_code == 403
+    res = client.post("/token/refresh", json={'refresh_token': rotated['refresh_token']})
+    assert res.status_code == 403
+
+
+def test_refresh_token_unknown(client):
+    res = client.post("/token/refresh", json={'refresh_token': 'unknown'})
+    assert res.status_code == 403
+
+
+def test_logout_revokes_access_and_refresh_tokens(client, test_admin):
+    tokens = _login(client, test_admin)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    res = client.post(
+        "/logout", json={'refresh_token': tokens['refresh_token']}, headers=headers
+    )
+    assert res.status_code == 204
+    assert client.post("/logout", headers=headers).status_code == 401
+    res = client.post("/token/refresh", json={'refresh_token': tokens['refresh_token']})
+    assert res.status_code == 403
+
+
+def test_issuing_refresh_tokens_purges_expired_ones(client, test_admin):
+    tokens = models.RefreshToken.__table__
+    expired = datetime.now(timezone.utc) - timedelta(days=1)
+    with Session(conftest.engine) as db:
+        db.execute(insert(tokens), [
+            {
+                'token_hash': f'expired-{uuid.uuid4()}',
+                'user_id': test_admin['id'],
+                'family_id': uuid.uuid4(),
+                'expires_at': expired,
+            }
+            for _ in range(3)
+        ])
+        db.commit()
+    _login(client, test_admin)
+    with Session(conftest.engine) as db:
+        count = select(func.count()).where(tokens.c.expires_at < func.now())
+        assert db.execute(count).scalar() == 0
+
+
+def test_revocations_sync_from_database(client, test_admin):
+    tokens = _login(client, test_admin)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    jti = oauth2.decode_token_data(tokens['access_token']).jti
+    assert client.post("/logout", headers=headers).status_code == 204
+
+    oauth2.denylist._revoked.clear()
+    oauth2.denylist._synced_at = None
+    assert client.post("/logout", headers=headers).status_code == 401
+    assert jti in oauth2.denylist
+
+
+def test_login_throttled_per_email(client, test_user, login_throttle, monkeypatch):
+    monkeypatch.setattr(login_throttle, 'per_email', 2)
+    credentials = {'username': test_user['email'], 'password': 'wrong'}
+    for _ in range(2):
+        assert client.post("/login", data=credentials).status_code == 403
+
+    res = client.post("/login", data=credentials)
+    assert res.status_code == 429
+    assert 1 <= int(res.headers['Retry-After']) <= login_throttle.window
+
+    res = client.post(
+        "/login", data={'username': test_user['email'], 'password': test_user['password']}
+    )
+    assert res.status_code == 429
+    assert client.post(
+        "/login", data={'username': 'other@gmail.com', 'password': 'wrong'}
+    ).status_code == 403
+
+
+def test_introspect_batch(client, test_user, test_admin, admin_token):
+    user_token = oauth2.create_access_token(
+        {"user_id": test_user['id'], "perms": permissions.mask(['confirmed'])}
+    )
+    revoked = _login(client, test_admin)['access_token']
+    assert client.post(
+        "/logout", headers={"Authorization": f"Bearer {revoked}"}
+    ).status_code == 204
+    unknown_user = oauth2.create_access_token({"user_id": str(uuid.uuid4())})
+
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    tokens = [user_token, 'not-a-token', revoked, unknown_user, user_token]
+    res = client.post("/introspect", json={'tokens': tokens}, headers=headers)
+    assert res.status_code == 200
+    results = res.json()['results']
+    assert results[0] == results[4]
+    assert results[0]['active'] is True
+    assert results[0]['sub'] == test_user['id']
+    assert results[0]['scope'] == 'users:read users:write'
+    assert results[0]['exp'] > 0
+    assert results[1:4] == [{'active': False}] * 3
+
+
+def test_introspect_requires_permission(client, test_user):
+    token = oauth2.create_access_token({"user_id": test_user['id']})
+    res = client.post(
+        "/introspect",
+        json={'tokens': [token]},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 401
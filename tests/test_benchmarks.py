@@ -0,0 +1,23 @@
+from benchmarks.compare import compare
+from benchmarks.report import summarize
+
+
+def test_summarize_percentiles():
+    summary = summarize([i / 1000 for i in range(1, 101)], elapsed=2, errors=3)
+    assert summary['count'] == 100
+    assert summary['errors'] == 3
+    assert summary['throughput'] == 50
+    assert 49 <= summary['p50_ms'] <= 51
+    assert 94 <= summary['p95_ms'] <= 96
+    assert summary['max_ms'] == 100
+
+
+def test_compare_flags_regressions():
+    base = {'login': {'throughput': 100, 'p50_ms': 10, 'p95_ms': 20, 'p99_ms': 30}}
+    new = {'login': {'throughput': 80, 'p50_ms': 10.5, 'p95_ms': 30, 'p99_ms': 30}}
+    regressed = {
+        metric for _, metric, *_, flag in compare(base, new, threshold=0.1) if flag
+    }
+    assert regressed == {'throughput', 'p95_ms'}
+    noisy = compare(base, new, threshold=0.1, min_delta_ms=20)
+    assert {metric for _, metric, *_, flag in noisy if flag} == {'throughput'}
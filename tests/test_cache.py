@@ -0,0 +1,52 @@
+import time
+
+from app import oauth2
+from app.cache import TTLCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set("a", 1)
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_invalidate():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_user_cache_stats(authorized_admin_client):
+    authorized_admin_client.get("/test-admin-access")
+    response = authorized_admin_client.get("/stats/user-cache")
+    assert response.status_code == 200
+    assert response.json()["hits"] > 0
+
+
+def test_token_cache_skips_repeated_decode(authorized_admin_client):
+    authorized_admin_client.get("/test-admin-access")
+    authorized_admin_client.get("/test-admin-access")
+    stats = authorized_admin_client.get("/stats/token-cache").json()
+    assert stats["hits"] >= 2
+    assert stats["decode_saved_ms"] > 0
+
+
+def test_decode_token_data_is_cached(token):
+    oauth2.token_cache.clear()
+    first = oauth2.decode_token_data(token)
+    assert oauth2.decode_token_data(token) is first
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+from passlib.hash import bcrypt
+from sqlalchemy.exc import IntegrityError
+
+from app import emails, models, utils
+from app.config import settings
+from tests import conftest
+
+
+@pytest.fixture
+def email_filter(monkeypatch):
+    monkeypatch.setattr(settings, 'email_filter', True)
+    emails.get_email_filter.cache_clear()
+    email_filter = emails.get_email_filter()
+    email_filter.engine = conftest.engine
+    yield email_filter
+    emails.get_email_filter.cache_clear()
+
+
+def _login(client, email, password):
+    return client.post('/login', data={'username': email, 'password': password})
+
+
+def test_unknown_email_skips_lookup(client, test_user, email_filter, monkeypatch):
+    dummy_verifies = []
+
+    async def verify_dummy(password):
+        dummy_verifies.append(password)
+        return False
+
+    monkeypatch.setattr(utils, 'verify_dummy', verify_dummy)
+    # the first lookup starts building the filter and queries the database
+    assert _login(client, 'nobody@example.com', 'secret').status_code == 403
+    email_filter._thread.join(timeout=10)
+    assert email_filter.ready
+    res = _login(client, 'nobody@example.com', 'secret')
+    assert res.status_code == 403
+    assert dummy_verifies == ['secret', 'secret']
+    assert not email_filter.might_exist('nobody@example.com')
+    assert email_filter.might_exist(test_user['email'].upper())
+
+
+def test_login_ignores_email_case(client, test_user, email_filter):
+    res = _login(client, test_user['email'].upper(), test_user['password'])
+    assert res.status_code == 200
+
+
+def test_signup_is_lowercased_and_added(client, email_filter):
+    res = client.post(
+        '/users', json={'email': 'Mixed.Case@Example.com', 'password': 'pw123456'}
+    )
+    assert res.status_code == 201
+    assert res.json()['email'] == 'mixed.case@example.com'
+    assert email_filter.might_exist('mixed.case@example.com')
+    assert _login(client, 'mixed.case@example.com', 'pw123456').status_code == 200
+    duplicate = client.post(
+        '/users', json={'email': 'MIXED.case@example.com', 'password': 'other'}
+    )
+    assert duplicate.status_code == 409
+
+
+def test_emails_are_unique_in_any_case(client, session, test_user):
+    res = client.post(
+        '/users', json={'email': test_user['email'].upper(), 'password': 'pw123456'}
+    )
+    assert res.status_code == 409
+    session.add(models.User(email=test_user['email'].title(), password='x'))
+    with pytest.raises(IntegrityError):
+        session.commit()
+    session.rollback()
+
+
+def test_sync_picks_up_users_of_other_workers(client, session, email_filter):
+    email_filter.rebuild()
+    assert _login(client, 'elsewhere@example.com', 'pw').status_code == 403
+    session.add(
+        models.User(email='elsewhere@example.com', password=bcrypt.hash('pw'))
+    )
+    session.commit()
+    email_filter._synced_at -= email_filter.sync_interval
+    assert _login(client, 'elsewhere@example.com', 'pw').status_code == 200
+
+
+def test_rebuild_runs_in_the_background(client, test_user, email_filter, monkeypatch):
+    email_filter.rebuild()
+    old_filter = email_filter._filter
+    email_filter._removed = old_filter.count
+    email_filter._synced_at -= email_filter.sync_interval
+    release = threading.Event()
+    rebuild = email_filter.rebuild
+    monkeypatch.setattr(
+        email_filter, 'rebuild', lambda: release.wait(10) and rebuild()
+    )
+    try:
+        # served from the old filter while the rebuild waits
+        res = _login(client, test_user['email'], test_user['password'])
+        assert res.status_code == 200
+        assert email_filter._filter is old_filter
+    finally:
+        release.set()
+    email_filter._thread.join(timeout=10)
+    assert email_filter._filter is not old_filter
+    assert email_filter.stats()['removed_since_rebuild'] == 0
+
+
+def test_email_filter_stats(authorized_admin_client, email_filter):
+    res = authorized_admin_client.get('/stats/email-filter')
+    assert res.status_code == 200
+    assert res.json()['enabled'] is True
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from passlib.hash import bcrypt
+
+from app import models, utils
+from app.calibrate import choose_rounds
+from app.hashing import HashingExecutor, HashingQueueFull
+
+
+def test_hashing_executor_records_stats():
+    executor = HashingExecutor(max_workers=1, queue_size=0)
+    try:
+        assert asyncio.run(executor.run(sum, [1, 2])) == 3
+        stats = executor.stats()
+    finally:
+        executor.shutdown()
+    assert stats["completed"] == 1
+    assert stats["pending"] == 0
+    assert stats["hash_time_max_ms"] >= 0
+
+
+def test_hashing_executor_fails_fast_when_full():
+    executor = HashingExecutor(max_workers=1, queue_size=1)
+
+    async def flood():
+        return await asyncio.gather(
+            *(executor.run(time.sleep, 0.2) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    try:
+        results = asyncio.run(flood())
+    finally:
+        executor.shutdown()
+    assert sum(isinstance(r, HashingQueueFull) for r in results) == 1
+    assert executor.stats()["rejected"] == 1
+
+
+def test_hashing_executor_replaces_a_broken_pool():
+    executor = HashingExecutor(max_workers=1, queue_size=0)
+    try:
+        assert asyncio.run(executor.run(sum, [1, 2])) == 3
+        # a hashing process killed by the OOM killer breaks its pool
+        for process in list(executor._pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        assert asyncio.run(executor.run(sum, [3, 4])) == 7
+        assert executor.stats()["restarts"] == 1
+        # a call that kills its process breaks the new pool too, and fails
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(executor.run(os._exit, 1))
+        assert asyncio.run(executor.run(sum, [5, 6])) == 11
+    finally:
+        executor.shutdown()
+
+
+def test_hashing_stats_require_admin(authorized_client):
+    response = authorized_client.get("/stats/hashing")
+    assert response.status_code == 401
+
+
+def test_hashing_stats(authorized_admin_client):
+    response = authorized_admin_client.get("/stats/hashing")
+    assert response.status_code == 200
+    assert response.json()["completed"] > 0
+
+
+def test_choose_rounds():
+    timings = {10: 0.06, 11: 0.12, 12: 0.25, 13: 0.5}
+    assert choose_rounds(timings, 0.3) == 12
+    assert choose_rounds(timings, 0.01) == 10
+
+
+def test_login_rehashes_other_cost(client, session, test_user2):
+    weak_hash = bcrypt.using(rounds=4).hash(test_user2['password'])
+    user = session.get(models.User, test_user2['id'])
+    user.password = weak_hash
+    session.commit()
+
+    res = client.post(
+        "/login",
+        data={'username': test_user2['email'], 'password': test_user2['password']},
+    )
+    assert res.status_code == 200
+    session.refresh(user)
+    assert user.password != weak_hash
+    assert not utils.pwd_context.needs_update(user.password)
+    assert bcrypt.verify(test_user2['password'], user.password)
@@ -0,0 +1,70 @@
+import json
+
+from app import utils
+from app.config import settings
+
+
+def test_import_users(authorized_admin_client, monkeypatch):
+    monkeypatch.setattr(settings, "import_hash_workers", 1)
+    password_hash = utils._hash("imported123")
+    rows = [
+        {"email": "imported1@gmail.com", "password": "imported123"},
+        {"email": "imported2@gmail.com", "password_hash": password_hash},
+        {"email": "imported1@gmail.com", "password": "imported123"},
+        {"email": "not-an-email", "password": "imported123"},
+        {"email": "imported3@gmail.com", "password_hash": "plain-text"},
+    ]
+    response = authorized_admin_client.post(
+        "/users/import",
+        data="\n".join(json.dumps(row) for row in rows),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    reports = [json.loads(line) for line in response.text.splitlines()]
+    assert response.status_code == 200
+    assert reports[-1] == {"imported": 2, "duplicates": 1, "invalid": 2}
+    duplicate = {"line": 3, "email": "imported1@gmail.com", "error": "duplicate email"}
+    assert duplicate in reports
+
+    for email in ("imported1@gmail.com", "imported2@gmail.com"):
+        res = authorized_admin_client.post(
+            "/login", data={"username": email, "password": "imported123"}
+        )
+        assert res.status_code == 200
+
+
+def test_import_users_csv(authorized_admin_client, monkeypatch):
+    monkeypatch.setattr(settings, "import_hash_workers", 1)
+    response = authorized_admin_client.post(
+        "/users/import",
+        data="email,password,scopes\nimported4@gmail.com,imported123,admin\n",
+        headers={"Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["imported"] == 1
+
+
+def test_import_rejects_empty_passwords_and_unknown_scopes(
+    authorized_admin_client, monkeypatch
+):
+    monkeypatch.setattr(settings, "import_hash_workers", 1)
+    executor = utils.get_hashing_executor()
+    completed = executor.stats()["completed"]
+    rows = [
+        {"email": "imported5@gmail.com", "password": ""},
+        {"email": "imported6@gmail.com", "password": "imported123", "scopes": ["root"]},
+        {"email": "imported7@gmail.com", "password": "imported123"},
+    ]
+    response = authorized_admin_client.post(
+        "/users/import",
+        data="\n".join(json.dumps(row) for row in rows),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    reports = [json.loads(line) for line in response.text.splitlines()]
+    assert reports == [
+        {"line": 1, "error": "password must not be empty"},
+        {"line": 2, "error": "unknown scopes: root"},
+        {"imported": 1, "duplicates": 0, "invalid": 2},
+    ]
+    # hashed in the shared pool rather than a pool of its own
+    assert executor.stats()["completed"] == completed + 1
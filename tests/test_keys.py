@@ -0,0 +1,48 @@
+import os
+import time
+
+from jose import jwt
+
+from app.keys import KeyRing, write_private_key
+
+
+def test_jwks_is_empty_for_symmetric_keys(client):
+    response = client.get("/.well-known/jwks.json")
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
+
+
+def test_keyring_signs_with_kid_and_publishes_jwks(tmp_path):
+    kid = write_private_key(str(tmp_path), "ES256")
+    keyring = KeyRing("ES256", keys_dir=str(tmp_path), publish_delay=0)
+    signing_kid, key = keyring.signing_key()
+    token = jwt.encode(
+        {"user_id": "1"}, key, algorithm="ES256", headers={"kid": signing_kid}
+    )
+
+    assert signing_kid == kid
+    assert [k["kid"] for k in keyring.jwks()["keys"]] == [kid]
+    public_jwk = keyring.jwks()["keys"][0]
+    assert jwt.decode(token, public_jwk, algorithms=["ES256"]) == {"user_id": "1"}
+
+
+def test_keyring_rotation_keeps_old_key_for_verification(tmp_path):
+    old_kid = write_private_key(str(tmp_path), "ES256")
+    old_path = tmp_path / f"{old_kid}.pem"
+    os.utime(old_path, (time.time() - 600, time.time() - 600))
+    keyring = KeyRing("ES256", keys_dir=str(tmp_path), publish_delay=300)
+    _, old_key = keyring.signing_key()
+    token = jwt.encode(
+        {"user_id": "1"}, old_key, algorithm="ES256", headers={"kid": old_kid}
+    )
+
+    new_kid = write_private_key(str(tmp_path), "ES256")
+    keyring.reload()
+    # the new key is published at once but only signs after the publish delay
+    assert keyring.signing_key()[0] == old_kid
+    assert {k["kid"] for k in keyring.jwks()["keys"]} == {old_kid, new_kid}
+
+    os.utime(tmp_path / f"{new_kid}.pem", (time.time() - 301, time.time() - 301))
+    keyring.reload()
+    assert keyring.signing_key()[0] == new_kid
+    assert jwt.decode(token, keyring.verification_key(old_kid), algorithms=["ES256"])
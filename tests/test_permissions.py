@@ -0,0 +1,25 @@
+import pytest
+
+from app import permissions
+
+
+def test_roles_inherit_permissions():
+    admin = permissions.mask(['admin'])
+    confirmed = permissions.mask(['confirmed'])
+    assert admin & confirmed == confirmed
+    assert set(permissions.names(confirmed)) == {'users:read', 'users:write'}
+    assert permissions.mask(['stats:read', 'unknown']) == permissions.BITS['stats:read']
+    assert permissions.mask(None) == 0
+
+
+def test_required_rejects_unknown_permission():
+    assert permissions.required(('admin',)) == permissions.BITS['admin']
+    with pytest.raises(ValueError):
+        permissions.required(('unknown',))
+
+
+def test_granting_lists_roles():
+    assert permissions.granting('users:read') == (
+        'users:read', 'registered', 'confirmed', 'admin'
+    )
+    assert permissions.granting('admin') == ('admin',)
@@ -0,0 +1,98 @@
+import pstats
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import metrics, profiling
+from app.config import settings
+from tests.conftest import SQLALCHEMY_DATABASE_URL_TEST
+
+
+@pytest.fixture
+def profiler(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'profiling', True)
+    monkeypatch.setattr(settings, 'profiling_dir', str(tmp_path))
+    profiling.get_profiler.cache_clear()
+    yield profiling.get_profiler()
+    profiling.get_profiler.cache_clear()
+
+
+@pytest.fixture
+def slow_query_log(monkeypatch):
+    monkeypatch.setattr(settings, 'slow_query_ms', 50)
+    metrics.get_slow_query_log.cache_clear()
+    yield metrics.get_slow_query_log()
+    metrics.get_slow_query_log.cache_clear()
+
+
+def _profiles(directory):
+    return sorted(path.name for path in directory.glob('*.prof'))
+
+
+def test_admin_header_profiles_request(authorized_admin_client, profiler, tmp_path):
+    res = authorized_admin_client.get('/stats/hashing', headers={'X-Profile': '1'})
+    assert res.status_code == 200
+    [name] = _profiles(tmp_path)
+    assert '-GET-stats_hashing-' in name
+    stats = pstats.Stats(str(tmp_path / name))
+    assert stats.total_calls > 0
+    assert profiler.stats()['written'] == 1
+
+
+def test_header_of_other_users_is_ignored(authorized_client, profiler, tmp_path):
+    authorized_client.get('/', headers={'X-Profile': '1'})
+    assert _profiles(tmp_path) == []
+    assert profiler.stats()['profiled'] == 0
+
+
+def test_sampled_requests_faster_than_threshold_are_dropped(
+    client, profiler, tmp_path
+):
+    profiler.sample_rate = 1
+    client.get('/')
+    [name] = _profiles(tmp_path)
+    assert '-GET-root-' in name
+    profiler.min_duration = 60
+    client.get('/')
+    assert len(_profiles(tmp_path)) == 1
+    assert profiler.stats()['too_fast'] == 1
+
+
+def test_spool_keeps_newest_profiles(client, profiler, tmp_path):
+    profiler.sample_rate = 1
+    profiler.max_files = 2
+    for _ in range(4):
+        client.get('/')
+    assert len(_profiles(tmp_path)) == 2
+    assert profiler.stats()['written'] == 4
+
+
+def test_slow_queries_are_logged_without_values(slow_query_log, caplog):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL_TEST)
+    metrics.instrument_engine(engine, 'slow')
+    token = metrics.current_route.set('/users/{idx}')
+    try:
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            conn.execute(
+                text('SELECT pg_sleep(0.1), :secret'), {'secret': 'hunter2'}
+            )
+    finally:
+        metrics.current_route.reset(token)
+        engine.dispose()
+    [entry] = slow_query_log.stats()['recent']
+    assert entry['route'] == '/users/{idx}'
+    assert entry['engine'] == 'slow'
+    assert entry['duration_ms'] >= 100
+    assert 'pg_sleep' in entry['statement']
+    assert entry['parameters'] == {'secret': 'str'}
+    assert 'hunter2' not in caplog.text
+    assert 'Slow query' in caplog.text
+
+
+def test_profiling_stats(authorized_admin_client, profiler, slow_query_log):
+    res = authorized_admin_client.get('/stats/profiling')
+    assert res.status_code == 200
+    assert res.json()['enabled'] is True
+    res = authorized_admin_client.get('/stats/slow-queries')
+    assert res.json()['threshold_ms'] == 50
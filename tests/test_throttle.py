@@ -0,0 +1,38 @@
+import asyncio
+
+from app.throttle import DatabaseBackend, MemoryBackend
+from tests.conftest import async_engine
+
+
+def test_memory_backend_limits_each_key():
+    backend = MemoryBackend(max_keys=10)
+
+    async def hits(key, count):
+        return [await backend.hit(key, 3, 60) for _ in range(count)]
+
+    retries = asyncio.run(hits('email:a', 5))
+    assert retries[:3] == [0, 0, 0]
+    assert all(0 < retry <= 60 for retry in retries[3:])
+    assert asyncio.run(hits('email:b', 1)) == [0]
+
+
+def test_memory_backend_bounds_keys():
+    backend = MemoryBackend(max_keys=10)
+
+    async def hits():
+        for index in range(100):
+            await backend.hit(f'ip:{index}', 3, 60)
+
+    asyncio.run(hits())
+    assert len(backend) == 10
+
+
+def test_database_backend_limits_each_key(session):
+    backend = DatabaseBackend(engine=async_engine)
+
+    async def hits(key, count):
+        return [await backend.hit(key, 3, 60) for _ in range(count)]
+
+    retries = asyncio.run(hits('email:db', 5))
+    assert retries[:3] == [0, 0, 0]
+    assert all(0 < retry <= 60 for retry in retries[3:])
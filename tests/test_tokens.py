@@ -0,0 +1,90 @@
+import time
+
+import pytest
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from app import oauth2, tokens
+from app.config import settings
+from app.keys import KeyRing, write_private_key
+
+
+@pytest.fixture(params=['HS256', 'ES256'])
+def keyring(request, tmp_path):
+    if request.param == 'HS256':
+        return KeyRing('HS256', secret_key='test-secret')
+    write_private_key(str(tmp_path), 'ES256')
+    return KeyRing('ES256', keys_dir=str(tmp_path), publish_delay=0)
+
+
+def _claims(**claims):
+    return {'user_id': '1', 'exp': int(time.time()) + 60, **claims}
+
+
+def test_backends_accept_each_others_tokens(keyring):
+    jose_codec = tokens.JoseCodec(keyring)
+    native = tokens.NativeCodec(keyring)
+    claims = _claims(perms=3)
+    native_token = native.encode(claims)
+    assert jose_codec.decode(native_token) == claims
+    assert native.decode(jose_codec.encode(claims)) == claims
+    assert native.decode(native_token) == claims
+    assert jwt.get_unverified_header(native_token) == {
+        'alg': keyring.algorithm, 'kid': keyring.signing_key()[0], 'typ': 'JWT'
+    }
+
+
+def test_native_rejects_tampered_tokens(keyring):
+    native = tokens.NativeCodec(keyring)
+    header, payload, signature = native.encode(_claims()).split('.')
+    forged = tokens.NativeCodec(KeyRing('HS256', secret_key='other')).encode(
+        _claims(perms=-1)
+    )
+    other_key = jwt.encode(_claims(), 'x', algorithm='HS256')
+    none_header = tokens._b64encode(b'{"alg":"none","typ":"JWT"}').decode()
+
+    for token in (
+        f'{header}.{forged.split(".")[1]}.{signature}',
+        f'{header}.{payload}.{signature[:-4]}AAAA',
+        f'{none_header}.{payload}.',
+        f'{header}.{payload}',
+        forged,
+        other_key,
+    ):
+        with pytest.raises(JWTError):
+            native.decode(token)
+
+
+def test_native_checks_time_claims(keyring):
+    native = tokens.NativeCodec(keyring)
+    with pytest.raises(ExpiredSignatureError):
+        native.decode(native.encode(_claims(exp=int(time.time()) - 1)))
+    with pytest.raises(JWTError):
+        native.decode(native.encode(_claims(nbf=int(time.time()) + 60)))
+    with pytest.raises(JWTError):
+        native.decode(native.encode(_claims(aud='elsewhere')))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        tokens.codec('pyjwt', KeyRing('HS256', secret_key='test-secret'))
+
+
+def test_requests_with_native_backend(client, test_user, monkeypatch):
+    monkeypatch.setattr(settings, 'jwt_backend', 'native')
+    oauth2.get_jwt_codec.cache_clear()
+    oauth2.get_token_cache().clear()
+    try:
+        res = client.post(
+            '/login',
+            data={'username': test_user['email'], 'password': test_user['password']},
+        )
+        token = res.json()['access_token']
+        assert isinstance(oauth2.get_jwt_codec(), tokens.NativeCodec)
+        res = client.get(
+            f"/users/{test_user['id']}",
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        assert res.status_code == 200
+    finally:
+        oauth2.get_jwt_codec.cache_clear()
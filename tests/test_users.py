@@ -1,7 +1,11 @@
+import json
+import uuid
+
 import pytest
 from jose import jwt
 from app import schemas
 from app.config import settings
+from app.oauth2 import create_access_token
 from tests.test_data import users
 
 
@@ -22,6 +26,13 @@ def test_create_user(client):
     assert res.status_code == 201
 
 
+def test_create_user_duplicate_email(client, test_admin):
+    res = client.post(
+        '/users', json={'email': test_admin['email'], 'password': 'password123'}
+    )
+    assert res.status_code == 409
+
+
 def test_login_user(test_user, client):
     res = client.post(
         '/login', data={
@@ -88,3 +99,127 @@ def test_update_user(authorized_client, test_user):
     response = authorized_client.put(url, json=data)
     assert response.status_code == 201
     assert response.json()['email'] == users[3].email
+
+
+def test_update_other_or_missing_user(authorized_client, test_admin):
+    data = {"email": "someone@gmail.com", "password": "password123"}
+    response = authorized_client.put(f"/users/{test_admin['id']}", json=data)
+    assert response.status_code == 403
+    response = authorized_client.put(f"/users/{uuid.uuid4()}", json=data)
+    assert response.status_code == 404
+    response = authorized_client.delete(f"/users/{uuid.uuid4()}")
+    assert response.status_code == 404
+
+
+def test_update_user_email_conflict(authorized_client, test_user, test_admin):
+    data = {"email": test_admin['email'], "password": "password123"}
+    response = authorized_client.put(f"/users/{test_user['id']}", json=data)
+    assert response.status_code == 409
+
+
+def test_delete_user(client, test_user2):
+    token = create_access_token({"user_id": test_user2['id']})
+    url = f"/users/{test_user2['id']}"
+    response = client.delete(url, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 204
+    assert client.get(url).status_code == 404
+
+
+def test_batch_get_users(client, test_user, test_admin):
+    missing = "6f1d8e3c-4b9a-4c1e-9a8e-2f5b7d3c1a90"
+    response = client.post(
+        "/users/batch-get", json={"ids": [test_user['id'], test_admin['id'], missing]}
+    )
+    assert response.status_code == 200
+    assert set(response.json()['users']) == {test_user['id'], test_admin['id']}
+    assert response.json()['missing'] == [missing]
+
+
+def test_batch_get_users_limit(client, monkeypatch):
+    monkeypatch.setattr(settings, "batch_get_max_ids", 1)
+    ids = ["6f1d8e3c-4b9a-4c1e-9a8e-2f5b7d3c1a90", "0b6f4c2e-8d1a-4f3b-9c7e-5a2d1e8f6b43"]
+    response = client.post("/users/batch-get", json={"ids": ids})
+    assert response.status_code == 422
+
+
+def test_list_users_keyset_pages(authorized_admin_client, test_user, test_admin):
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 1, **({"cursor": cursor} if cursor else {})}
+        response = authorized_admin_client.get("/users", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        seen += [user['id'] for user in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen))
+    assert {test_user['id'], test_admin['id']} <= set(seen)
+
+    response = authorized_admin_client.get("/users", params={"stream": True})
+    streamed = [json.loads(line)['id'] for line in response.text.splitlines()]
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert streamed == seen
+
+
+def test_list_users_invalid_cursor(authorized_admin_client):
+    response = authorized_admin_client.get("/users", params={"cursor": "garbage"})
+    assert response.status_code == 422
+
+
+def test_fast_responses_match(client, test_admin, monkeypatch):
+    url = f"/users/{test_admin['id']}"
+    validated = client.get(url)
+    monkeypatch.setattr(settings, 'fast_responses', True)
+    fast = client.get(url)
+    assert fast.status_code == 200
+    assert fast.json() == validated.json()
+    assert client.get(f"/users/{uuid.uuid4()}").status_code == 404
+
+    res = client.post(
+        '/login',
+        data={'username': test_admin['email'], 'password': test_admin['password']},
+    )
+    assert res.status_code == 200
+    assert set(res.json()) == {'access_token', 'token_type', 'refresh_token'}
+
+
+def test_permission_scopes_append_and_filter(authorized_admin_client, test_user):
+    url = f"/update-permission/{test_user['id']}"
+
+    def update(scope, denied_access=False):
+        return authorized_admin_client.patch(
+            url, params={"scope": scope, "denied_access": denied_access}
+        )
+
+    assert update("confirmed").json()['scopes'] == ["confirmed"]
+    assert update("stats:read").json()['scopes'] == ["confirmed", "stats:read"]
+    assert update("stats:read").json()['scopes'] == ["confirmed", "stats:read"]
+    assert update("unknown").status_code == 422
+
+    def holders(permission):
+        response = authorized_admin_client.get(
+            "/users", params={"permission": permission}
+        )
+        assert response.status_code == 200
+        return {user['id'] for user in response.json()['items']}
+
+    assert test_user['id'] in holders("users:read")
+    assert test_user['id'] not in holders("admin")
+    assert authorized_admin_client.get(
+        "/users", params={"permission": "unknown"}
+    ).status_code == 422
+
+    assert update("confirmed", denied_access=True).json()['scopes'] == ["stats:read"]
+    assert update("stats:read", denied_access=True).json()['scopes'] == []
+
+
+def test_login_token_carries_permission_mask(client, test_admin):
+    res = client.post(
+        '/login',
+        data={'username': test_admin['email'], 'password': test_admin['password']},
+    )
+    claims = jwt.get_unverified_claims(res.json()['access_token'])
+    assert claims['perms'] == 0
+    assert 'scopes' not in claims